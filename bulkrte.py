@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""Vectorized decoding and validation of RIP route entries using NumPy.
+Meant for tools that process large numbers of datagrams at once, e.g.
+packet captures. NumPy is optional; the RIP server doesn't need it."""
+
+# Copyright (C) 2012 Patrick F. Allen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import struct
+
+import ipaddr
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# These mirror ripserv.RIPHeader and ripserv.RIPRouteEntry. ripserv isn't
+# imported here so that it can use this module itself.
+HDR_FORMAT = ">BBH"
+HDR_SIZE = struct.calcsize(HDR_FORMAT)
+RTE_SIZE = 20
+TYPE_RESPONSE = 2
+AF_INET = 2
+MIN_METRIC = 0
+MAX_METRIC = 16
+
+if numpy:
+    # Same layout as ripserv.RIPRouteEntry.FORMAT (">HHIIII").
+    RTE_DTYPE = numpy.dtype([ ("afi",     ">u2"),
+                              ("tag",     ">u2"),
+                              ("address", ">u4"),
+                              ("mask",    ">u4"),
+                              ("nexthop", ">u4"),
+                              ("metric",  ">u4"),
+                            ])
+    assert(RTE_DTYPE.itemsize == RTE_SIZE)
+
+    # Netmasks for prefix lengths 0 through 32, which happen to be in
+    # ascending order.
+    _MASKS = numpy.array([ (0xffffffff << (32 - n)) & 0xffffffff
+                           for n in range(33) ], dtype=numpy.uint32)
+
+
+def _require_numpy():
+    if numpy is None:
+        raise(ImportError("NumPy is required for bulk RTE processing."))
+
+
+class RTEBatch(object):
+    """A columnar batch of decoded RTEs. Each attribute is a NumPy array
+    with one element per RTE:
+
+    afi, tag, address, prefixlen, nexthop, metric -- The RTE fields, with
+        address masked to a network ID, the mask converted to a prefix
+        length and a nexthop of 0.0.0.0 replaced by the source address.
+    source -- The integer source address of the datagram the RTE came in.
+    valid -- True if the RTE passed validation (AFI, metric range and mask
+        contiguity). Other fields of invalid RTEs are unspecified."""
+
+    def __init__(self, rtes, source):
+        """rtes -- A NumPy array of RTE_DTYPE records.
+        source -- A NumPy array of integer source addresses, one per RTE."""
+        _require_numpy()
+        mask = rtes["mask"].astype(numpy.uint32)
+        metric = rtes["metric"].astype(numpy.uint32)
+        nexthop = rtes["nexthop"].astype(numpy.uint32)
+        source = numpy.asarray(source, dtype=numpy.uint32)
+
+        # A valid mask is one of _MASKS, and its index there is the prefix
+        # length.
+        prefixlen = numpy.searchsorted(_MASKS, mask).clip(0, 32)
+
+        self.afi = rtes["afi"].astype(numpy.uint16)
+        self.tag = rtes["tag"].astype(numpy.uint16)
+        self.address = rtes["address"].astype(numpy.uint32) & mask
+        self.prefixlen = prefixlen.astype(numpy.uint8)
+        self.nexthop = numpy.where(nexthop == 0, source, nexthop)
+        self.metric = metric
+        self.source = source
+        self.valid = (self.afi == AF_INET)         & \
+                     (_MASKS[prefixlen] == mask)   & \
+                     (metric >= MIN_METRIC)        & \
+                     (metric <= MAX_METRIC)
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __repr__(self):
+        return "RTEBatch(%d RTEs, %d valid)" % (len(self),
+                                                self.valid.sum())
+
+    def rows(self):
+        """Return a list of (afi, tag, address, prefixlen, nexthop, metric,
+        source) integer tuples for the valid RTEs."""
+        valid = self.valid
+        columns = [ self.afi, self.tag, self.address, self.prefixlen,
+                    self.nexthop, self.metric, self.source ]
+        return zip(*[ column[valid].tolist() for column in columns ])
+
+
+def decode(data, src_ip):
+    """Decode the RTEs of a single response datagram into an RTEBatch.
+    Raises ValueError if the datagram is malformed."""
+    return decode_datagrams([ (data, src_ip) ])
+
+
+def decode_datagrams(datagrams):
+    """Decode the RTEs of many response datagrams into one RTEBatch.
+    datagrams is an iterable of (data, src_ip) pairs, where src_ip is
+    anything accepted by ipaddr.IPv4Address. Raises ValueError if any
+    datagram is malformed or isn't a RIPv2 response."""
+    _require_numpy()
+    chunks = []
+    sources = []
+    counts = []
+    for data, src_ip in datagrams:
+        datalen = len(data)
+        if datalen < HDR_SIZE or (datalen - HDR_SIZE) % RTE_SIZE:
+            raise(ValueError("Malformed datagram from %s." % src_ip))
+        cmd, ver, zero = struct.unpack_from(HDR_FORMAT, data)
+        if cmd != TYPE_RESPONSE or ver != 2 or zero:
+            raise(ValueError("Not a RIPv2 response from %s." % src_ip))
+        chunks.append(data[HDR_SIZE:])
+        sources.append(int(ipaddr.IPv4Address(src_ip)))
+        counts.append((datalen - HDR_SIZE) / RTE_SIZE)
+
+    rtes = numpy.frombuffer("".join(chunks), dtype=RTE_DTYPE)
+    source = numpy.repeat(numpy.array(sources, dtype=numpy.uint32), counts)
+    return RTEBatch(rtes, source)
+
+
+class RouteColumns(object):
+    """A columnar copy of the advertised fields of a set of routes (e.g. a
+    rib.RIB), from which whole-table updates can be packed with a few
+    vector operations and a single copy. Build a new one whenever the
+    routes change."""
+
+    def __init__(self, routes):
+        """routes -- An iterable of ripserv.RIPRouteEntry objects."""
+        _require_numpy()
+        fields = [ (rt.afi, rt.tag, rt.network.network._ip,
+                    rt.network.netmask._ip, rt.nexthop._ip, rt.metric)
+                   for rt in routes ]
+        self.rtes = numpy.array(fields, dtype=RTE_DTYPE)
+        self._nexthop = self.rtes["nexthop"].astype(numpy.uint32)
+
+    def __len__(self):
+        return len(self.rtes)
+
+    def serialize_update(self, hdr, iface_ip, iface_prefixlen,
+                         split_horizon=True, max_rtes=25):
+        """Return a list of update messages advertising the routes out of
+        an interface. Each message is hdr followed by at most max_rtes
+        RTEs.
+
+        iface_ip -- The interface's integer IP address.
+        iface_prefixlen -- The prefix length of the interface's subnet.
+        split_horizon -- If True, leave out routes whose nexthop is on the
+            interface's subnet.
+
+        As in ripserv.RIP._build_update, the nexthop is set to 0.0.0.0
+        unless it is a different router on the interface's subnet."""
+        mask = _MASKS[iface_prefixlen]
+        on_link = (self._nexthop & mask) == (iface_ip & mask)
+        if split_horizon:
+            rtes = self.rtes[~on_link]
+            rtes["nexthop"] = 0
+        else:
+            rtes = self.rtes.copy()
+            keep = on_link & (self._nexthop != iface_ip)
+            rtes["nexthop"] = numpy.where(keep, self._nexthop, 0)
+
+        packed = rtes.tobytes()
+        step = max_rtes * RTE_SIZE
+        return [ hdr + packed[i:i+step] for i in range(0, len(packed), step) ]
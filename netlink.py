@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""Minimal rtnetlink support for talking to the Linux kernel directly."""
+
+# Copyright (C) 2012 Patrick F. Allen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import errno
+import itertools
+import os
+import socket
+import struct
+
+from twisted.internet.interfaces import IReadDescriptor
+from zope.interface import implementer
+
+# Constants from linux/netlink.h, linux/rtnetlink.h, linux/if.h,
+# linux/if_link.h, linux/if_addr.h and linux/fib_rules.h.
+NETLINK_ROUTE = 0
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_NEWRULE = 32
+RTM_DELRULE = 33
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+
+IFLA_IFNAME = 3
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+IFF_RUNNING = 0x40
+IFF_MULTICAST = 0x1000
+IFF_LOWER_UP = 0x10000
+
+FRA_PRIORITY = 6
+FRA_TABLE = 15
+FR_ACT_TO_TBL = 1
+
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_NOWHERE = 255
+RTN_UNSPEC = 0
+RTN_UNICAST = 1
+RT_TABLE_UNSPEC = 0
+RT_TABLE_MAIN = 254
+
+NLMSGHDR = struct.Struct("=IHHII")
+RTATTR = struct.Struct("=HH")
+# struct rtmsg and struct fib_rule_hdr have the same layout.
+RTMSG = struct.Struct("=BBBBBBBBI")
+NLMSGERR = struct.Struct("=i")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+U32 = struct.Struct("=I")
+
+# Default size of the receive buffer, large enough for the ACKs of a big
+# batch of route changes.
+RCVBUF_SIZE = 4 * 1024 * 1024
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type, data):
+    """Return a packed route attribute."""
+    length = RTATTR.size + len(data)
+    return RTATTR.pack(length, attr_type) + data + \
+           "\0" * (_align(length) - length)
+
+
+def pack_message(msg_type, flags, seq, payload):
+    """Return a packed netlink message."""
+    return NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, seq,
+                         0) + payload
+
+
+def parse_messages(data):
+    """Return a list of (type, flags, seq, payload) tuples for the netlink
+    messages in data."""
+    messages = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        messages.append((msg_type, flags, seq,
+                         data[offset+NLMSGHDR.size:offset+length]))
+        offset += _align(length)
+    return messages
+
+
+def parse_attrs(data, offset=0):
+    """Return a dict of raw attribute values keyed on type for the route
+    attributes in data, starting at offset."""
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type] = data[offset+RTATTR.size:offset+length]
+        offset += _align(length)
+    return attrs
+
+
+def _pack_ip(address):
+    return socket.inet_aton(str(address))
+
+
+def route_message(msg_type, flags, seq, dst, dst_len, table, gateway=None,
+                  priority=None):
+    """Return a packed RTM_NEWROUTE or RTM_DELROUTE message for an IPv4
+    route to dst/dst_len in table."""
+    if msg_type == RTM_DELROUTE:
+        protocol, scope, rtm_type = 0, RT_SCOPE_NOWHERE, RTN_UNSPEC
+    else:
+        protocol, scope, rtm_type = RTPROT_BOOT, RT_SCOPE_UNIVERSE, \
+                                    RTN_UNICAST
+    payload = RTMSG.pack(socket.AF_INET, dst_len, 0, 0,
+                         table if table < 256 else RT_TABLE_UNSPEC,
+                         protocol, scope, rtm_type, 0)
+    payload += pack_attr(RTA_TABLE, U32.pack(table))
+    payload += pack_attr(RTA_DST, _pack_ip(dst))
+    if gateway is not None:
+        payload += pack_attr(RTA_GATEWAY, _pack_ip(gateway))
+    if priority is not None:
+        payload += pack_attr(RTA_PRIORITY, U32.pack(priority))
+    return pack_message(msg_type, flags, seq, payload)
+
+
+def rule_message(msg_type, flags, seq, priority, table):
+    """Return a packed RTM_NEWRULE or RTM_DELRULE message for an IPv4 rule
+    that looks up table at priority."""
+    payload = RTMSG.pack(socket.AF_INET, 0, 0, 0,
+                         table if table < 256 else RT_TABLE_UNSPEC,
+                         0, 0, FR_ACT_TO_TBL, 0)
+    payload += pack_attr(FRA_TABLE, U32.pack(table))
+    payload += pack_attr(FRA_PRIORITY, U32.pack(priority))
+    return pack_message(msg_type, flags, seq, payload)
+
+
+def parse_route(payload):
+    """Return a dict describing an RTM_NEWROUTE/RTM_DELROUTE payload. Keys
+    are family, dst, dst_len, tos, table, protocol, type, gateway, priority
+    and oif. Addresses are dotted decimal strings; missing values are None."""
+    family, dst_len, src_len, tos, table, protocol, scope, rtm_type, \
+        flags = RTMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, RTMSG.size)
+    route = { "family": family,
+              "dst": "0.0.0.0",
+              "dst_len": dst_len,
+              "tos": tos,
+              "table": table,
+              "protocol": protocol,
+              "type": rtm_type,
+              "gateway": None,
+              "priority": None,
+              "oif": None,
+            }
+    if family != socket.AF_INET:
+        return route
+    if RTA_TABLE in attrs:
+        route["table"] = U32.unpack(attrs[RTA_TABLE])[0]
+    if RTA_DST in attrs:
+        route["dst"] = socket.inet_ntoa(attrs[RTA_DST])
+    if RTA_GATEWAY in attrs:
+        route["gateway"] = socket.inet_ntoa(attrs[RTA_GATEWAY])
+    if RTA_PRIORITY in attrs:
+        route["priority"] = U32.unpack(attrs[RTA_PRIORITY])[0]
+    if RTA_OIF in attrs:
+        route["oif"] = U32.unpack(attrs[RTA_OIF])[0]
+    return route
+
+
+def parse_link(payload):
+    """Return a dict describing an RTM_NEWLINK/RTM_DELLINK payload, with
+    keys index, name and flags (the IFF_* bits)."""
+    family, if_type, index, flags, change = IFINFOMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFINFOMSG.size)
+    return { "index": index,
+             "name": attrs.get(IFLA_IFNAME, "").rstrip("\0"),
+             "flags": flags,
+           }
+
+
+def parse_addr(payload):
+    """Return a dict describing an RTM_NEWADDR/RTM_DELADDR payload, with
+    keys family, index, address (dotted decimal, or None if not IPv4),
+    prefixlen and label."""
+    family, prefixlen, flags, scope, index = IFADDRMSG.unpack_from(payload)
+    attrs = parse_attrs(payload, IFADDRMSG.size)
+    address = None
+    if family == socket.AF_INET:
+        # IFA_LOCAL is the local address; IFA_ADDRESS is the peer address
+        # on point-to-point links.
+        raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        if raw:
+            address = socket.inet_ntoa(raw)
+    return { "family": family,
+             "index": index,
+             "address": address,
+             "prefixlen": prefixlen,
+             "label": attrs.get(IFA_LABEL, "").rstrip("\0"),
+           }
+
+
+class NetlinkError(Exception):
+    def __init__(self, error, message=""):
+        self.errno = error
+        self.message = message or os.strerror(error)
+
+    def __str__(self):
+        return self.message
+
+
+class NetlinkSocket(object):
+    """An rtnetlink socket."""
+
+    def __init__(self, groups=0, rcvbuf=RCVBUF_SIZE):
+        """groups -- A bitmask of multicast groups to subscribe to."""
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((0, groups))
+        self._seq = itertools.count(1)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def next_seq(self):
+        return next(self._seq)
+
+    def send(self, data):
+        """Send one or more packed messages in a single call."""
+        self.sock.send(data)
+
+    def recv_messages(self, block=True):
+        """Return the messages from one read of the socket, or an empty list
+        if block is False and there is nothing to read."""
+        try:
+            if block:
+                data = self.sock.recv(65536)
+            else:
+                data = self.sock.recv(65536, socket.MSG_DONTWAIT)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        return parse_messages(data)
+
+    def request(self, msg_type, flags, payload):
+        """Send a request and wait for the reply. Returns the payloads of
+        any reply messages (e.g. for a dump). Raises NetlinkError if the
+        kernel reports an error."""
+        seq = self.next_seq()
+        self.send(pack_message(msg_type, flags | NLM_F_REQUEST | NLM_F_ACK,
+                               seq, payload))
+        replies = []
+        while True:
+            for reply_type, reply_flags, reply_seq, reply in \
+                self.recv_messages():
+                if reply_seq != seq:
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return replies
+                if reply_type == NLMSG_ERROR:
+                    error = NLMSGERR.unpack_from(reply)[0]
+                    if error:
+                        raise(NetlinkError(-error))
+                    return replies
+                replies.append(reply)
+
+
+@implementer(IReadDescriptor)
+class NetlinkReader(object):
+    """Hands messages arriving on a NetlinkSocket to a callback from the
+    reactor. Add it with reactor.addReader."""
+
+    def __init__(self, nlsock, callback):
+        """callback is called with a list of (type, flags, seq, payload)
+        tuples."""
+        self.nlsock = nlsock
+        self.callback = callback
+
+    def fileno(self):
+        return self.nlsock.fileno()
+
+    def doRead(self):
+        messages = self.nlsock.recv_messages(block=False)
+        if messages:
+            self.callback(messages)
+
+    def connectionLost(self, reason):
+        pass
+
+    def logPrefix(self):
+        return "netlink"
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""Rate limiting for outgoing updates: token buckets, and a pacer that
+spreads an interface's periodic update over part of the update interval
+instead of sending it in one burst."""
+
+# Copyright (C) 2012 Patrick F. Allen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+
+
+class TokenBucket(object):
+    """A token bucket. Tokens accumulate at rate per second up to burst,
+    and each unit of work takes one."""
+
+    def __init__(self, rate, burst, now):
+        """rate -- Tokens added per second.
+        burst -- Most tokens the bucket holds. It starts out full.
+        now -- The current time in seconds."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._last = now
+
+    def _refill(self, now):
+        if now > self._last:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, now, count=1):
+        """Take count tokens and return True if there are enough, otherwise
+        return False and leave the bucket alone."""
+        self._refill(now)
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+    def delay(self, now, count=1):
+        """Return the seconds until count tokens will be available."""
+        self._refill(now)
+        if self.tokens >= count:
+            return 0
+        return (count - self.tokens) / float(self.rate)
+
+    def idle(self, now):
+        """Return True if the bucket has refilled to burst, so forgetting
+        it and starting a new one would change nothing."""
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class RequestLimiter(object):
+    """A token bucket per host, for up to max_hosts hosts.
+
+    When a new host comes along and max_hosts are already tracked, an idle
+    bucket (see TokenBucket.idle), least recently used first, makes way
+    for it. If every bucket is in use, the new host isn't tracked and its
+    requests are refused until one goes idle. So requests from many
+    source addresses can't each be given a fresh burst, and the limit
+    still lets in new hosts once old ones have gone quiet."""
+
+    def __init__(self, rate, burst, max_hosts):
+        """rate, burst -- As for TokenBucket, for each host.
+        max_hosts -- Most hosts to track."""
+        self.rate = rate
+        self.burst = burst
+        self.max_hosts = max_hosts
+        # TokenBuckets keyed on host, least recently used first.
+        self._buckets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, host, now):
+        """Take a token from host's bucket, and return whether there was
+        one."""
+        bucket = self._buckets.pop(host, None)
+        if bucket is None:
+            if len(self._buckets) >= self.max_hosts and \
+               not self._evict_idle(now):
+                return False
+            bucket = TokenBucket(self.rate, self.burst, now)
+        self._buckets[host] = bucket
+        return bucket.consume(now)
+
+    def _evict_idle(self, now):
+        """Forget the least recently used idle bucket, and return whether
+        there was one."""
+        for host, bucket in self._buckets.iteritems():
+            if bucket.idle(now):
+                break
+        else:
+            return False
+        del self._buckets[host]
+        return True
+
+
+class UpdatePacer(object):
+    """Sends the updates for one interface through a token bucket.
+
+    A periodic update is sent at the rate that spreads it over a given
+    window. Changes made while it is being sent go out as urgent messages
+    (triggered updates), which are sent before any remaining periodic
+    messages. So that the periodic messages sent after them don't undo
+    those changes, a periodic update is given as a list of keys (e.g.
+    route prefixes), fixed for the cycle, and each message is built from
+    its share of the keys just before it is sent. Every key is sent once
+    per cycle, and building a message costs no more than its keys."""
+
+    def __init__(self, reactor, send, burst):
+        """reactor -- Provides callLater and seconds.
+        send -- Called with each message to send it.
+        burst -- Messages that may be sent back to back. The bucket refills
+            at least this many tokens per second."""
+        self.reactor = reactor
+        self._send = send
+        self.bucket = TokenBucket(burst, burst, reactor.seconds())
+        self._urgent = collections.deque()
+        # The periodic update's keys, the function building a message from
+        # some of them, the keys per message, the index of the next key to
+        # send, and when to start sending them.
+        self._periodic = None
+        self._build = None
+        self._per_message = 1
+        self._index = 0
+        self._start = 0
+        self._call = None
+        self.sent = 0
+
+    def pending(self):
+        """Return True if there are messages waiting to be sent."""
+        return bool(self._urgent) or self._periodic is not None
+
+    def send_periodic(self, keys, build, window, delay=0, per_message=1):
+        """Send a periodic update spread over window seconds (which must be
+        positive), starting after delay seconds. keys is split into lists
+        of up to per_message keys, and build is called with each list when
+        its turn comes to return the message for it, or None if there is
+        nothing to send. Periodic messages still waiting from the last call
+        are dropped."""
+        count = -(-len(keys) // per_message)
+        self.bucket.rate = max(count / float(window), self.bucket.burst)
+        self._periodic = keys
+        self._build = build
+        self._per_message = per_message
+        self._index = 0
+        self._start = self.reactor.seconds() + delay
+        self._run()
+
+    def send_urgent(self, msgs):
+        """Send msgs ahead of any waiting periodic messages, as soon as the
+        bucket allows."""
+        self._urgent.extend(msgs)
+        self._run()
+
+    def stop(self):
+        """Drop all waiting messages."""
+        self._cancel()
+        self._urgent.clear()
+        self._periodic = None
+        self._build = None
+
+    def _cancel(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _next(self):
+        """Build and return the next periodic message, or None once they
+        have all been sent."""
+        keys = self._periodic
+        while self._index < len(keys):
+            chunk = keys[self._index:self._index + self._per_message]
+            self._index += self._per_message
+            msg = self._build(chunk)
+            if msg is not None:
+                return msg
+        self._periodic = None
+        self._build = None
+        return None
+
+    def _run(self):
+        self._cancel()
+        while True:
+            now = self.reactor.seconds()
+            if not self._urgent:
+                if self._periodic is None:
+                    return
+                if now < self._start:
+                    self._call = self.reactor.callLater(self._start - now,
+                                                        self._run)
+                    return
+            if not self.bucket.consume(now):
+                # Waiting at least a whole token's time makes sure that time
+                # moves on, even if the bucket is short by a rounding error.
+                delay = max(self.bucket.delay(now), 1.0 / self.bucket.rate)
+                self._call = self.reactor.callLater(delay, self._run)
+                return
+            if self._urgent:
+                msg = self._urgent.popleft()
+            else:
+                msg = self._next()
+                if msg is None:
+                    self.bucket.tokens += 1
+                    return
+            self._send(msg)
+            self.sent += 1
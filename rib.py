@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+
+"""Routing information base for the RIP server."""
+
+# Copyright (C) 2012 Patrick F. Allen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import time
+
+import ipaddr
+
+# _MASKS[n] is the 32 bit netmask for a prefix length of n.
+_MASKS = [ (0xffffffff << (32 - n)) & 0xffffffff for n in range(33) ]
+# Mirrors ripserv.RIPRouteEntry.MAX_METRIC, which can't be imported here.
+MAX_METRIC = 16
+
+
+def _bit(addr, pos):
+    """Return bit number pos of addr, counting from the most significant
+    bit (bit 0)."""
+    return (addr >> (31 - pos)) & 1
+
+
+class _TrieNode(object):
+    __slots__ = ("prefix", "preflen", "value", "children")
+
+    def __init__(self, prefix, preflen, value=None):
+        self.prefix = prefix
+        self.preflen = preflen
+        self.value = value
+        self.children = [None, None]
+
+
+class PrefixTrie(object):
+    """A path-compressed binary (Patricia) trie of IPv4 prefixes. Prefixes
+    are integer (network, prefix length) pairs. Nodes without a value are
+    only kept as branch points, so a lookup visits at most 33 nodes."""
+
+    def __init__(self):
+        self._root = None
+
+    def _link(self, parent, node):
+        """Point parent's child link (or the root) at node."""
+        if parent is None:
+            self._root = node
+        else:
+            parent.children[_bit(node.prefix, parent.preflen)] = node
+
+    def insert(self, prefix, preflen, value):
+        """Insert or replace the value stored for prefix/preflen."""
+        new = _TrieNode(prefix, preflen, value)
+        parent = None
+        node = self._root
+        while node:
+            limit = min(node.preflen, preflen)
+            common = limit
+            diff = node.prefix ^ prefix
+            if diff:
+                common = min(32 - diff.bit_length(), limit)
+
+            if common == node.preflen:
+                if node.preflen == preflen:
+                    node.value = value
+                    return
+                parent = node
+                node = node.children[_bit(prefix, node.preflen)]
+                continue
+
+            # The new prefix and node diverge (or the new prefix covers
+            # node), so a node needs to be inserted above node.
+            if common == preflen:
+                new.children[_bit(node.prefix, preflen)] = node
+                self._link(parent, new)
+            else:
+                glue = _TrieNode(prefix & _MASKS[common], common)
+                glue.children[_bit(node.prefix, common)] = node
+                glue.children[_bit(prefix, common)] = new
+                self._link(parent, glue)
+            return
+        self._link(parent, new)
+
+    def remove(self, prefix, preflen):
+        """Remove the value stored for prefix/preflen. Raises KeyError if
+        there is no such prefix."""
+        path = []
+        node = self._root
+        while node and node.preflen < preflen:
+            if prefix & _MASKS[node.preflen] != node.prefix:
+                break
+            path.append(node)
+            node = node.children[_bit(prefix, node.preflen)]
+        if not node or node.preflen != preflen or node.prefix != prefix or \
+           node.value is None:
+            raise(KeyError((prefix, preflen)))
+
+        node.value = None
+        parent = path[-1] if path else None
+
+        # Prune nodes that no longer hold a value or branch.
+        children = [ c for c in node.children if c ]
+        if len(children) == 2:
+            return
+        if children:
+            self._link(parent, children[0])
+            return
+        if parent is None:
+            self._root = None
+            return
+        parent.children[_bit(prefix, parent.preflen)] = None
+        if parent.value is None:
+            grandparent = path[-2] if len(path) > 1 else None
+            sibling = [ c for c in parent.children if c ][0]
+            self._link(grandparent, sibling)
+
+    def lookup(self, addr):
+        """Return the value of the longest prefix containing the integer
+        address addr, or None if no prefix matches."""
+        best = None
+        node = self._root
+        while node:
+            if addr & _MASKS[node.preflen] != node.prefix:
+                break
+            if node.value is not None:
+                best = node.value
+            if node.preflen == 32:
+                break
+            node = node.children[_bit(addr, node.preflen)]
+        return best
+
+    def covered(self, prefix, preflen):
+        """Return the values of all prefixes equal to or more specific than
+        prefix/preflen."""
+        node = self._root
+        while node and node.preflen < preflen:
+            if prefix & _MASKS[node.preflen] != node.prefix:
+                return []
+            node = node.children[_bit(prefix, node.preflen)]
+        if not node or node.prefix & _MASKS[preflen] != prefix:
+            return []
+
+        values = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                values.append(node.value)
+            stack.extend(c for c in node.children if c)
+        return values
+
+
+class RIB(object):
+    """Holds the routes known by RIP. Routes are indexed on the integer
+    (network, prefix length) pair of their destination, so lookups, inserts
+    and deletes don't depend on the size of the table. A prefix trie is
+    kept alongside the index for longest prefix match queries.
+
+    generation is incremented whenever a route is added, removed or
+    changed, so that anything derived from the RIB can tell when it is out
+    of date. Added and changed routes are also recorded (and flagged with
+    rt.changed) until clear_changed is called, so that triggered updates
+    don't need to walk the whole table."""
+
+    def __init__(self):
+        self._routes = {}
+        self._trie = PrefixTrie()
+        self._changed = []
+        self.generation = 0
+
+    @staticmethod
+    def key(network):
+        """Return the index key for an ipaddr.IPv4Network."""
+        return (network.network._ip, network.prefixlen)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __iter__(self):
+        return self._routes.itervalues()
+
+    def __contains__(self, rt):
+        return self._routes.get(self.key(rt.network)) is rt
+
+    def __repr__(self):
+        return "RIB(%d routes)" % len(self._routes)
+
+    def get(self, network):
+        """Return the route to an ipaddr.IPv4Network, or None if there is
+        no such route."""
+        return self._routes.get(self.key(network))
+
+    def get_by_key(self, key):
+        """Return the route indexed by an integer (network, prefix length)
+        tuple, or None if there is no such route."""
+        return self._routes.get(key)
+
+    def get_many(self, keys):
+        """Return a list of the routes indexed by each of keys, with None
+        for keys that have no route."""
+        get = self._routes.get
+        return [ get(key) for key in keys ]
+
+    def add(self, rt):
+        """Add a route. Replaces any existing route to the same prefix."""
+        key = self.key(rt.network)
+        self._routes[key] = rt
+        self._trie.insert(key[0], key[1], rt)
+        self.changed(rt)
+
+    def remove(self, rt):
+        """Remove a route. Raises KeyError if the route isn't in the RIB."""
+        key = self.key(rt.network)
+        if self._routes.get(key) is not rt:
+            raise(KeyError(key))
+        del self._routes[key]
+        self._trie.remove(key[0], key[1])
+        self.generation += 1
+
+    def changed(self, rt):
+        """Must be called after a route's metric or nexthop is modified.
+        Drops the route's cached serialization and records the route as
+        changed."""
+        rt.packed = None
+        self.generation += 1
+        if not rt.changed:
+            rt.changed = True
+            self._changed.append(rt)
+
+    def changed_routes(self):
+        """Return the routes added or changed since the last call to
+        clear_changed that are still in the RIB."""
+        return [ rt for rt in self._changed if rt in self ]
+
+    def clear_changed(self):
+        """Forget about added and changed routes."""
+        for rt in self._changed:
+            rt.changed = False
+        self._changed = []
+
+    def routes(self):
+        """Return a list of all routes, sorted by prefix."""
+        return [ self._routes[key] for key in sorted(self._routes) ]
+
+    def lookup(self, ip):
+        """Return the longest prefix match route for an IP address (anything
+        accepted by ipaddr.IPv4Address), or None if no route matches."""
+        return self._trie.lookup(ipaddr.IPv4Address(ip)._ip)
+
+    def covered(self, network):
+        """Return the routes inside a network (anything accepted by
+        ipaddr.IPv4Network), including a route to the network itself,
+        sorted by prefix."""
+        network = ipaddr.IPv4Network(network)
+        routes = self._trie.covered(network.network._ip, network.prefixlen)
+        return sorted(routes, key=lambda rt: self.key(rt.network))
+
+
+class RouteTimers(object):
+    """A min-heap of route deadlines in integer ticks (see util.ticks). A
+    route's deadline is its timeout (the tick it was last refreshed at) plus
+    a fixed interval.
+
+    Refreshing a route only ever moves its deadline later, so refreshes
+    don't touch the heap. When an entry with an outdated deadline reaches
+    the top, it is pushed back with the route's current deadline instead of
+    expiring. A route is in the heap at most once."""
+
+    def __init__(self, interval, cond):
+        """interval -- Seconds from a route's timeout until it expires.
+        cond -- Called with a route. Routes for which it returns False are
+            dropped from the heap instead of expiring."""
+        self.interval = interval
+        self._cond = cond
+        self._heap = []
+        self._queued = set()
+        # Tiebreaker so that routes themselves are never compared.
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, rt):
+        """Start tracking rt's deadline. Routes without a timeout (imported
+        routes) are ignored."""
+        if rt.timeout is None or id(rt) in self._queued:
+            return
+        self._queued.add(id(rt))
+        heapq.heappush(self._heap, (rt.timeout + self.interval,
+                                    next(self._seq), rt))
+
+    def expired(self, now):
+        """Remove and return the routes whose deadline is before now."""
+        routes = []
+        heap = self._heap
+        while heap and heap[0][0] < now:
+            deadline, seq, rt = heapq.heappop(heap)
+            if not self._cond(rt) or rt.timeout is None:
+                self._queued.discard(id(rt))
+                continue
+            current_deadline = rt.timeout + self.interval
+            if current_deadline >= now:
+                heapq.heappush(heap, (current_deadline, seq, rt))
+                continue
+            self._queued.discard(id(rt))
+            routes.append(rt)
+        return routes
+
+    def next_deadline(self):
+        """Return the earliest deadline in the heap, or None if it is
+        empty. Entries may be outdated, so this is a lower bound."""
+        if not self._heap:
+            return None
+        return self._heap[0][0]
+
+
+class _Neighbor(object):
+    __slots__ = ("routes", "heard", "oldest")
+
+    def __init__(self, now):
+        # Routes learned from the neighbor, keyed on id. Routes that have
+        # since moved to another nexthop are dropped lazily.
+        self.routes = {}
+        # Tick the neighbor was last heard from.
+        self.heard = now
+        # Lower bound on the timeouts of the neighbor's routes.
+        self.oldest = now
+
+
+class NeighborTimers(object):
+    """Route timeouts tracked per neighbor (the nexthop a route was learned
+    from) rather than per route. A route's timeout is the tick it was last
+    seen in a response, and each neighbor records the tick it was last
+    heard from and a lower bound on its routes' timeouts.
+
+    Refreshing a route is just setting its timeout. Checking for expired
+    routes only looks at the neighbors, and only goes through the routes
+    of neighbors that have one that may have expired. When a neighbor
+    stops sending updates, all of its routes expire in one pass and the
+    neighbor is dropped."""
+
+    def __init__(self, interval, cond):
+        """interval -- Seconds from a route's timeout until it expires.
+        cond -- Called with a route. Routes for which it returns False are
+            dropped instead of expiring."""
+        self.interval = interval
+        self._cond = cond
+        # Keyed on integer nexthop address.
+        self._neighbors = {}
+
+    def __len__(self):
+        return sum(len(neighbor.routes) for neighbor in
+                   self._neighbors.values())
+
+    def schedule(self, rt):
+        """Start tracking rt's timeout under its nexthop. Routes without a
+        timeout (imported routes) are ignored."""
+        if rt.timeout is None:
+            return
+        neighbor = self._neighbors.get(rt.nexthop._ip)
+        if neighbor is None:
+            neighbor = self._neighbors[rt.nexthop._ip] = _Neighbor(rt.timeout)
+        neighbor.routes[id(rt)] = rt
+        neighbor.heard = max(neighbor.heard, rt.timeout)
+        neighbor.oldest = min(neighbor.oldest, rt.timeout)
+
+    def heard(self, address, now):
+        """Record that the neighbor with integer address address was heard
+        from at tick now."""
+        neighbor = self._neighbors.get(address)
+        if neighbor is not None:
+            neighbor.heard = now
+
+    def expired(self, now):
+        """Remove and return the routes whose deadline is before now, as a
+        list of (neighbor address, gone, routes) tuples. gone is True if
+        the neighbor hasn't been heard from within the interval and has no
+        routes left, in which case it is no longer tracked."""
+        before = now - self.interval
+        results = []
+        for address, neighbor in self._neighbors.items():
+            if neighbor.oldest >= before:
+                continue
+            routes, live = self._sweep(address, neighbor, before)
+            gone = not live and neighbor.heard < before
+            if gone:
+                del self._neighbors[address]
+            if routes or gone:
+                results.append((address, gone, routes))
+        return results
+
+    def withdraw(self, network, mask):
+        """Stop tracking the neighbors whose integer address & mask is
+        network, and return their routes."""
+        routes = []
+        for address, neighbor in self._neighbors.items():
+            if address & mask == network:
+                del self._neighbors[address]
+                routes.extend(rt for rt in neighbor.routes.itervalues() if
+                              self._tracked(address, rt))
+        return routes
+
+    def next_deadline(self):
+        """Return the earliest deadline of any tracked route, or None if no
+        routes are tracked. This is a lower bound."""
+        if not self._neighbors:
+            return None
+        return min(neighbor.oldest for neighbor in
+                   self._neighbors.values()) + self.interval
+
+    def _tracked(self, address, rt):
+        return rt.timeout is not None and rt.nexthop._ip == address and \
+               self._cond(rt)
+
+    def _sweep(self, address, neighbor, before):
+        """Remove the expired and no longer tracked routes of neighbor.
+        Returns the expired routes, and whether any routes are left."""
+        expired = []
+        oldest = None
+        for key, rt in neighbor.routes.items():
+            if not self._tracked(address, rt):
+                del neighbor.routes[key]
+            elif rt.timeout < before:
+                del neighbor.routes[key]
+                expired.append(rt)
+            elif oldest is None or rt.timeout < oldest:
+                oldest = rt.timeout
+        neighbor.oldest = oldest if oldest is not None else neighbor.heard
+        return expired, oldest is not None
+
+
+class ResponseCache(object):
+    """Remembers the responses last received from each neighbor, so that a
+    response received again unchanged, as periodic updates usually are, can
+    be handled by refreshing the routes it refreshed last time instead of
+    decoding it.
+
+    Responses are keyed on their payload, which is its own digest: the
+    string hash is cheap, and equal payloads are compared in full, so
+    there are no collisions. Neighbors are whatever the caller uses to tell
+    them apart, e.g. (source address, interface address) pairs.
+
+    A response is only handled this way if processing it again would just
+    refresh routes. That is checked against the RIB when the response is
+    remembered and again whenever the RIB has changed since."""
+
+    def __init__(self, rib, max_responses=8192, max_total=16384,
+                 max_neighbors=256):
+        """rib -- The RIB the routes are in.
+        max_responses -- Most responses to remember per neighbor. The least
+            recently received are forgotten first.
+        max_total -- Most responses to remember in all. The least recently
+            received of the least recently heard from neighbor are
+            forgotten first.
+        max_neighbors -- Most neighbors to remember responses from. The
+            least recently heard from are forgotten first."""
+        self._rib = rib
+        self.max_responses = max_responses
+        self.max_total = max_total
+        self.max_neighbors = max_neighbors
+        # OrderedDicts of [RIB generation, (key, metric) pairs, routes to
+        # refresh] lists keyed on payload, keyed on neighbor, least
+        # recently heard from first.
+        self._neighbors = collections.OrderedDict()
+        # Tick each neighbor was last heard from.
+        self._heard = {}
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._count
+
+    def neighbors(self):
+        """Return the number of neighbors responses are remembered from."""
+        return len(self._neighbors)
+
+    def refresh(self, neighbor, source, payload, now):
+        """If payload was remembered for neighbor and processing it again
+        would only refresh routes, refresh them and return True. Otherwise
+        return False, and the response should be processed as usual.
+
+        source -- The neighbor's integer address, which learned routes have
+            as their nexthop.
+        now -- The current tick (see util.ticks)."""
+        responses = self._neighbors.get(neighbor)
+        entry = responses.get(payload) if responses is not None else None
+        if entry is None:
+            self.misses += 1
+            return False
+        if entry[0] != self._rib.generation:
+            routes = self._check(entry[1], source)
+            if routes is None:
+                del responses[payload]
+                self._count -= 1
+                self.misses += 1
+                return False
+            entry[0] = self._rib.generation
+            entry[2] = routes
+        # As rt.init_timeout() would; none of these are imported routes.
+        for rt in entry[2]:
+            rt.timeout = now
+        self._heard_from(neighbor, now)
+        self.hits += 1
+        return True
+
+    def remember(self, neighbor, source, payload, rtes, now):
+        """Remember a response from neighbor once it has been processed.
+        rtes is a list of (RIB key, metric) pairs for its RTEs, with the
+        metrics as they were after adding the cost of the link."""
+        responses = self._heard_from(neighbor, now)
+        if responses.pop(payload, None) is not None:
+            self._count -= 1
+        routes = self._check(rtes, source)
+        if routes is None:
+            return
+        responses[payload] = [ self._rib.generation, rtes, routes ]
+        self._count += 1
+        if len(responses) > self.max_responses:
+            responses.popitem(last=False)
+            self._count -= 1
+        while self._count > self.max_total:
+            oldest, responses = next(self._neighbors.iteritems())
+            responses.popitem(last=False)
+            self._count -= 1
+            if not responses:
+                self._drop(oldest)
+
+    def forget(self, network=None):
+        """Forget the responses from neighbors whose address (the first item
+        of the neighbor, if it is a tuple) is in network, an
+        ipaddr.IPv4Network, or from all neighbors if it is None."""
+        for neighbor in self._neighbors.keys():
+            source = neighbor[0] if isinstance(neighbor, tuple) else neighbor
+            if network is None or ipaddr.IPv4Address(source) in network:
+                self._drop(neighbor)
+
+    def expire(self, before):
+        """Forget the responses from neighbors not heard from since the
+        tick before."""
+        for neighbor, heard in self._heard.items():
+            if heard < before:
+                self._drop(neighbor)
+
+    def _heard_from(self, neighbor, now):
+        """Note that neighbor was heard from, making it the most recently
+        heard from, and return its responses. Neighbors over max_neighbors
+        are forgotten."""
+        responses = self._neighbors.pop(neighbor, None)
+        if responses is None:
+            responses = collections.OrderedDict()
+        self._neighbors[neighbor] = responses
+        self._heard[neighbor] = now
+        while len(self._neighbors) > self.max_neighbors:
+            self._drop(next(self._neighbors.iterkeys()))
+        return responses
+
+    def _drop(self, neighbor):
+        """Forget neighbor and its responses."""
+        self._count -= len(self._neighbors.pop(neighbor))
+        del self._heard[neighbor]
+
+    def _check(self, rtes, source):
+        """Return the routes that processing RTEs from source again would
+        refresh, or None if it would change anything. This mirrors
+        ripserv.RIP.try_add_route."""
+        get_by_key = self._rib.get_by_key
+        routes = []
+        for key, metric in rtes:
+            rt = get_by_key(key)
+            if rt is None:
+                if metric < MAX_METRIC:
+                    return None
+            elif rt.nexthop._ip == source:
+                if rt.metric != metric:
+                    return None
+                if not rt.garbage:
+                    routes.append(rt)
+            elif metric < rt.metric:
+                return None
+        return routes
+
+
+# Snapshot file layout: a header, then one fixed size record per route.
+SNAPSHOT_MAGIC = "RIPS"
+SNAPSHOT_VERSION = 1
+# Magic, version, record count, wall clock time written.
+SNAPSHOT_HEADER = struct.Struct(">4sHId")
+# Network, prefix length, garbage flag, tag, nexthop, metric, seconds left
+# on the route's timeout (or garbage collection) timer.
+SNAPSHOT_RECORD = struct.Struct(">IBBHIIi")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(path, records):
+    """Write a RIB snapshot. records is a list of (network, prefixlen,
+    garbage, tag, nexthop, metric, remaining) tuples, with the network and
+    nexthop as integers. The file is replaced atomically."""
+    data = [ SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                  len(records), time.time()) ]
+    data.extend(SNAPSHOT_RECORD.pack(*record) for record in records)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write("".join(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Read a RIB snapshot written by write_snapshot. Returns the records,
+    with remaining reduced by the time since the snapshot was written.
+    Raises SnapshotError if the file is malformed, or IOError/OSError if it
+    can't be read."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < SNAPSHOT_HEADER.size:
+            raise(SnapshotError("Snapshot is truncated."))
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, count, written = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise(SnapshotError("Not a version %d RIB snapshot." % \
+                                SNAPSHOT_VERSION))
+        if size != SNAPSHOT_HEADER.size + count * SNAPSHOT_RECORD.size:
+            raise(SnapshotError("Snapshot size doesn't match its %d "
+                                "records." % count))
+
+        elapsed = max(int(time.time() - written), 0)
+        records = []
+        offset = SNAPSHOT_HEADER.size
+        unpack_from = SNAPSHOT_RECORD.unpack_from
+        for i in xrange(count):
+            record = unpack_from(data, offset)
+            records.append(record[:-1] + (record[-1] - elapsed,))
+            offset += SNAPSHOT_RECORD.size
+        return records
+    finally:
+        data.close()
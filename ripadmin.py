@@ -70,8 +70,53 @@ class RIPAdminCLI(Cmd):
 
     def do_show_routes(self, line):
         """Show routes known by RIP."""
-        self.sendline("%d routes:" % len(self.ripinstance._routes))
-        self.sendline(pprint.pformat(self.ripinstance._routes))
+        routes = self.ripinstance._routes.routes()
+        self.sendline("%d routes:" % len(routes))
+        self.sendline(pprint.pformat(routes))
+
+    def do_show_route_for(self, line):
+        """Show the longest prefix match route for an IP address.
+        Usage: show_route_for <IP>"""
+        args = line.split()
+        if len(args) != 1:
+            self.usage()
+            return
+        try:
+            rt = self.ripinstance._routes.lookup(args[0])
+        except ValueError:
+            self.stdout.write("Bad IP address.\n")
+            self.usage()
+            return
+        if not rt:
+            self.sendline("No route to %s." % args[0])
+        else:
+            self.sendline(rt)
+
+    def do_show_routes_within(self, line):
+        """Show routes inside a network, including the network itself.
+        Usage: show_routes_within <NETWORK/PREFIXLEN>"""
+        args = line.split()
+        if len(args) != 1:
+            self.usage()
+            return
+        try:
+            routes = self.ripinstance._routes.covered(args[0])
+        except ValueError:
+            self.stdout.write("Bad network.\n")
+            self.usage()
+            return
+        self.sendline("%d routes:" % len(routes))
+        self.sendline(pprint.pformat(routes))
+
+    def do_show_request_stats(self, line):
+        """Show how many whole-table requests were answered and how many
+        were ignored for going over the rate limit."""
+        rip = self.ripinstance
+        self.sendline("Whole-table requests served: %d" %
+                      rip.whole_requests_served)
+        self.sendline("Whole-table requests throttled: %d" %
+                      rip.whole_requests_throttled)
+        self.sendline("Requesters tracked: %d" % len(rip._requesters))
 
     def do_debug(self, line):
         """Subscribe to log messages from a subsystem.
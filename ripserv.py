@@ -26,14 +26,14 @@ import binascii
 import logging
 import logging.config
 import random
-import datetime
 import traceback
 import functools
+import socket
 
 try:
     import ipaddr
     from twisted.internet import protocol
-    from twisted.internet import reactor
+    from twisted.internet import threads
     from twisted.python import log
     import twisted.python.failure
 except ImportError:
@@ -41,7 +41,10 @@ except ImportError:
     sys.stderr.write("Exception was:\n")
     raise
 
+import bulkrte
+import pacing
 import ripadmin
+import rib
 import sysiface
 import util
 
@@ -52,10 +55,24 @@ class RIP(protocol.DatagramProtocol):
     MAX_ROUTES_PER_UPDATE = 25
     JITTER_VALUE = 2
     DEFAULT_UPDATE_TIMER = 30
+    DEFAULT_GC_WINDOW = 5
+    DEFAULT_UPDATE_SPREAD = 0.5
+    # Update messages an interface may send back to back when pacing.
+    UPDATE_BURST = 8
+    DEFAULT_REQUEST_RATE = 1
+    # Whole-table requests a host may make back to back.
+    REQUEST_BURST = 3
+    # Seconds a whole-table response may be reused after the RIB changes.
+    WHOLE_RESPONSE_MAX_AGE = 1
+    # Most requesters to track. Idle ones make way for new ones.
+    MAX_REQUESTERS = 1024
 
     def __init__(self, port=520, user_routes=None, importroutes=False,
                  requested_ifaces=None, log_config="logging.conf",
-                 base_timer=None, admin_port=5120):
+                 base_timer=None, admin_port=5120, gc_window=None,
+                 fib_backend="ip", snapshot=None, snapshot_interval=None,
+                 redistribute=False, system=None, reactor=None,
+                 run_reactor=True, update_spread=None, request_rate=None):
         """port -- The UDP port to listen and send on.
         user_routes -- A list of routes to advertise.
         importroutes -- If True, look in the main kernel routing table for
@@ -63,7 +80,42 @@ class RIP(protocol.DatagramProtocol):
         requested_ifaces -- A list of interface names to send updates out of.
             If None, use all interfaces.
         log_config -- The logging config file.
-        base_timer -- Influences update/garbage/timeout timers"""
+        base_timer -- Influences update/garbage/timeout timers
+        gc_window -- Seconds that garbage collection waits after the first
+            route is due, so that routes due within the window are deleted
+            together.
+        fib_backend -- How routes are programmed on Linux: "ip" to run ip
+            in batch mode, or "netlink" to talk rtnetlink directly.
+        snapshot -- A file to save learned routes to, periodically and when
+            exiting. If given, routes are left installed when exiting, and
+            the saved routes are restored at startup, so that a restart
+            doesn't disturb forwarding.
+        snapshot_interval -- Seconds between snapshots. Defaults to the
+            update timer.
+        redistribute -- If True, keep following the main kernel routing
+            table after startup, advertising routes as they are added and
+            withdrawing them as they are removed. Implies importroutes.
+        system -- A sysiface system interface to use instead of the one for
+            the current OS, e.g. a sysiface.SimulatedSystem. fib_backend is
+            ignored if given.
+        reactor -- The reactor to run on. Defaults to the global twisted
+            reactor. Anything providing callLater, callWhenRunning, seconds
+            and listenMulticast will do, e.g. a simulated network.
+        run_reactor -- If False, return once set up instead of running the
+            reactor, so that it can be run by the caller (e.g. with several
+            RIP instances on it).
+        update_spread -- The fraction of the update interval that each
+            interface's periodic update is spread over, starting at a random
+            offset chosen separately for each interface. 0 sends the whole
+            table in one burst.
+        request_rate -- Whole-table requests per second answered for each
+            requesting host, after an initial burst. Requests over the rate
+            are ignored. 0 answers every request.
+
+        admin_port may be None to leave out the admin interface."""
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
         self.init_logging(log_config)
         self.log.info("RIP is starting up...")
         self._suppress_triggered_updates = False
@@ -77,20 +129,59 @@ class RIP(protocol.DatagramProtocol):
         self.update_timer = base_timer
         self.garbage_timer = base_timer * 4
         self.timeout_timer = base_timer * 6
+        if gc_window is None:
+            gc_window = self.DEFAULT_GC_WINDOW
+        self.gc_window = gc_window
+        if update_spread is None:
+            update_spread = self.DEFAULT_UPDATE_SPREAD
+        self.update_spread = update_spread
+        if request_rate is None:
+            request_rate = self.DEFAULT_REQUEST_RATE
+        self.request_rate = request_rate
+        self.snapshot_path = snapshot
+        self.snapshot_interval = snapshot_interval or self.update_timer
         self.log.debug1("Using timers: Update: %d, gc: %d, timeout: %d" % \
                        (self.update_timer, self.garbage_timer,
                         self.timeout_timer))
 
         self._route_change = False
         self._gc_started = False
-        if sys.platform == "linux2":
-            self._sys = sysiface.LinuxSystem(log_config=log_config)
+        self._timeout_timers = rib.NeighborTimers(self.timeout_timer,
+                                   lambda rt: not rt.garbage and \
+                                              rt in self._routes)
+        self._gc_timers = rib.RouteTimers(self.garbage_timer,
+                              lambda rt: rt.garbage and rt in self._routes)
+        if system is not None:
+            self._sys = system
+        elif sys.platform == "linux2" and fib_backend == "netlink":
+            self._sys = sysiface.NetlinkSystem(reactor=reactor,
+                                               log_config=log_config)
+        elif sys.platform == "linux2":
+            self._sys = sysiface.LinuxSystem(log_config=log_config,
+                                    call_later=reactor.callLater,
+                                    defer_to_thread=threads.deferToThread)
         elif sys.platform.startswith("win"):
             self._sys = sysiface.WindowsSystem(log_config=log_config)
         else:
             raise(NotSupported("No support for current OS."))
         self.port = port
-        self._routes = []
+        self._routes = rib.RIB()
+        # Serialized periodic updates, see _get_cached_update.
+        self._update_cache = {}
+        self._route_columns = (None, None)
+        # Keys of routes imported by redistribution.
+        self._redistributed = set()
+        # Responses last received from each neighbor, to skip decoding
+        # repeated ones. See rib.ResponseCache.
+        self._responses = rib.ResponseCache(self._routes)
+        # pacing.UpdatePacers keyed on interface IP.
+        self._pacers = {}
+        # Whole-table request buckets, keyed on integer requester address.
+        self._requesters = pacing.RequestLimiter(request_rate,
+                                                 self.REQUEST_BURST,
+                                                 self.MAX_REQUESTERS)
+        self.whole_requests_served = 0
+        self.whole_requests_throttled = 0
 
         # Nexthop of 0.0.0.0 tells receivers to use the source IP on the
         # packet for the nexthop address. See RFC 2453 section 4.4.
@@ -111,6 +202,10 @@ class RIP(protocol.DatagramProtocol):
                 self.log.debug5("Trying to add user route %s" % rte)
                 self.try_add_route(rte, nexthop, False)
 
+        # Redistributing implies importing, but when the system can follow
+        # the table, watching it imports the routes already there.
+        if redistribute:
+            importroutes = not self._sys.watches_local_routes
         if importroutes:
             for net, mask in self._sys.get_local_routes():
                 # Windows includes all local routes, including /32 routes
@@ -124,141 +219,231 @@ class RIP(protocol.DatagramProtocol):
                                     imported=True)
                 self.try_add_route(rte, nexthop, False)
 
+        if self.snapshot_path:
+            self._restore_snapshot()
+
+        # Remove whatever a previous run left in the system routing table
+        # and isn't in the snapshot.
+        self._sys.reconcile_fib([ rt for rt in self._routes if
+                                  rt.nexthop.exploded != "0.0.0.0" ])
+
         self.activate_ifaces(requested_ifaces)
-        self._last_update_time = datetime.datetime.now()
+        self._sys.watch_interfaces(reactor, self)
+        self._last_update_time = reactor.seconds()
 
         # Setup admin interface
-        ripadmin.start(self, port=admin_port)
+        if admin_port is not None:
+            ripadmin.start(self, port=admin_port)
 
         reactor.callWhenRunning(self.generate_periodic_update)
         reactor.callWhenRunning(self._check_route_timeouts)
         reactor.callWhenRunning(self.send_request)
-        reactor.listenMulticast(port, self)
-        reactor.run()
-
-    def send_request(self):
-        """Send a multicast request message out of each active interface."""
+        if redistribute:
+            reactor.callWhenRunning(self._sys.watch_local_routes, reactor,
+                                    self)
+        if self.snapshot_path:
+            reactor.callLater(self.snapshot_interval,
+                              self._write_snapshot_periodically)
+        rip_port = reactor.listenMulticast(port, self)
+        if self._sys.fib_writer is not None:
+            # Stop reading updates while the kernel is far behind.
+            self._sys.fib_writer.register_producer(rip_port)
+        if run_reactor:
+            reactor.run()
+
+    def send_request(self, ifaces=None):
+        """Send a multicast request message out of each active interface, or
+        out of the given interfaces."""
         hdr = RIPHeader(cmd=RIPHeader.TYPE_REQUEST, ver=2)
         rte = [ RIPRouteEntry(afi=0, address="0.0.0.0", mask=0, tag=0,
                  metric=RIPRouteEntry.MAX_METRIC, nexthop="0.0.0.0") ]
         request = RIPPacket(hdr=hdr, rtes=rte).serialize()
 
-        for iface in self.get_active_ifaces():
+        if ifaces is None:
+            ifaces = self.get_active_ifaces()
+        for iface in ifaces:
             self.send_update(request, iface.ip.ip.exploded)
 
-    def stopProtocol(self):
-        self.log.info("RIP is shutting down.")
-        self.cleanup()
-
-    def _act_on_routes_before_time(self, action, cond, timer):
-        """Take an action on a route if its timeout is less than a given time.
-        Doesn't count routes that don't meet the given condition (cond) or
-        if their timeout is set to None.
-
-        timer is a number of seconds that will determine when the next call
-        time should be.
-
-        Returns the next time this function should be called based on the
-        rt.timeout values, or returns None if no values were greater than
-        timer."""
-        now = datetime.datetime.now()
-        timeout_delta = datetime.timedelta(seconds=timer)
-        before_time = now - timeout_delta
-        lowest_timer = before_time
+    def _restore_snapshot(self):
+        """Add the routes saved in the snapshot file by a previous run. They
+        are assumed to still be installed in the system routing table, and
+        age out as if the previous run hadn't stopped."""
+        try:
+            records = rib.read_snapshot(self.snapshot_path)
+        except (IOError, OSError) as e:
+            self.log.info("No RIB snapshot loaded: %s" % e)
+            return
+        except rib.SnapshotError as e:
+            self.log.error("Ignoring RIB snapshot %s: %s" % \
+                           (self.snapshot_path, e))
+            return
 
-        for rt in self._routes:
-            if not cond(rt):
+        now = util.ticks()
+        restored = 0
+        for network, prefixlen, garbage, tag, nexthop, metric, remaining in \
+            records:
+            if garbage and remaining < 0:
                 continue
-            if rt.timeout == None:
+            if self._routes.get_by_key((network, prefixlen)):
                 continue
-
-            if rt.timeout < before_time:
-                action(rt)
+            rt = CompactRTE(CompactRTE.AF_INET, tag, network, prefixlen,
+                            nexthop, metric).to_route_entry()
+            rt.garbage = bool(garbage)
+            self._routes.add(rt)
+            if rt.garbage:
+                rt.timeout = now - (self.garbage_timer - remaining)
+                self._gc_timers.schedule(rt)
             else:
-                lowest_timer = max(lowest_timer, rt.timeout)
+                rt.timeout = now - (self.timeout_timer - remaining)
+                self._timeout_timers.schedule(rt)
+            restored += 1
+
+        if self._gc_timers and not self._gc_started:
+            self._gc_started = True
+            self.reactor.callLater(self._next_timer_call(self._gc_timers) +
+                                   self.gc_window,
+                                   self._collect_garbage_routes)
+        self.log.info("Restored %d routes from the RIB snapshot." % restored)
+
+    def _write_snapshot(self):
+        """Save learned routes and how long they have left to the snapshot
+        file."""
+        now = util.ticks()
+        records = []
+        for rt in self._routes:
+            if rt.timeout is None:
+                continue
+            if rt.garbage:
+                remaining = rt.timeout + self.garbage_timer - now
+            else:
+                remaining = rt.timeout + self.timeout_timer - now
+            records.append((rt.network.network._ip, rt.network.prefixlen,
+                            int(rt.garbage), rt.tag, rt.nexthop._ip,
+                            rt.metric, remaining))
+        try:
+            rib.write_snapshot(self.snapshot_path, records)
+        except (IOError, OSError) as e:
+            self.log.error("Failed to write RIB snapshot %s: %s" % \
+                           (self.snapshot_path, e))
+            return
+        self.log.debug2("Saved %d routes to the RIB snapshot." % len(records))
 
-        if lowest_timer == before_time:
-            return None
-        else:
-            return (lowest_timer + timeout_delta - now).total_seconds() + 1
+    def _write_snapshot_periodically(self):
+        self._write_snapshot()
+        self.reactor.callLater(self.snapshot_interval,
+                               self._write_snapshot_periodically)
 
-    def _start_garbage_collection(self, rt):
+    def stopProtocol(self):
+        self.log.info("RIP is shutting down.")
+        self.cleanup()
+
+    def _start_garbage_collection(self, rt, uninstall=False):
+        """Advertise rt as unreachable until it is deleted. If uninstall is
+        True, remove it from the system routing table now rather than
+        keeping it there with an infinite metric."""
         if rt.garbage:
             self.log.debug2("Route was already on GC: %s" % rt)
             return
 
         self.log.debug2("Starting garbage collection for route %s" % rt)
-        rt.changed = True
-        rt.garbage = True
-        rt.init_timeout()
-        rt.metric = RIPRouteEntry.MAX_METRIC
-        self._sys.modify_route(rt)
+        self._start_garbage_collection_routes([rt], uninstall)
+
+    def _start_garbage_collection_routes(self, rts, uninstall=False):
+        """Start garbage collection for routes that aren't on GC yet in one
+        operation, e.g. all the routes from a neighbor that went away. See
+        _start_garbage_collection."""
+        if not rts:
+            return
+        for rt in rts:
+            rt.garbage = True
+            rt.init_timeout()
+            rt.metric = RIPRouteEntry.MAX_METRIC
+            self._routes.changed(rt)
+            if not uninstall:
+                self._sys.modify_route(rt)
+            self._gc_timers.schedule(rt)
+        if uninstall:
+            self._sys.uninstall_routes(rts)
+            for rt in rts:
+                rt.uninstalled = True
         self._route_change = True
         self._init_garbage_collection_timer()
 
+    def _next_timer_call(self, timers):
+        """Return the number of seconds until the earliest deadline in
+        timers has passed, or None if timers is empty."""
+        deadline = timers.next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - util.ticks() + 1, 1)
+
     def _check_route_timeouts(self):
         self.log.debug2("Checking route timeouts...")
-        action = self._start_garbage_collection
-        cond = lambda x: not x.garbage
-
-        next_call_time = self._act_on_routes_before_time(action, cond,
-                                              self.timeout_timer)
+        for neighbor, gone, routes in \
+            self._timeout_timers.expired(util.ticks()):
+            if gone:
+                self.log.info("Neighbor %s timed out, withdrawing %d "
+                              "routes." % (_int_to_ip(neighbor),
+                                           len(routes)))
+            else:
+                self.log.debug2("%d routes from %s timed out." % \
+                                (len(routes), _int_to_ip(neighbor)))
+            self._start_garbage_collection_routes(routes)
+        self._responses.expire(util.ticks() - self.timeout_timer)
 
         if self._route_change:
             self._send_triggered_update()
 
+        next_call_time = self._next_timer_call(self._timeout_timers)
         if not next_call_time:
             next_call_time = self.timeout_timer
 
         self.log.debug2("Checking timeouts again in %d second(s)" %
                        next_call_time)
-        reactor.callLater(next_call_time, self._check_route_timeouts)
+        self.reactor.callLater(next_call_time, self._check_route_timeouts)
 
     def _init_garbage_collection_timer(self):
         if self._gc_started:
             return
         self._gc_started = True
-        reactor.callLater(self.garbage_timer, self._collect_garbage_routes)
+        self.reactor.callLater(self.garbage_timer + self.gc_window,
+                               self._collect_garbage_routes)
 
     def _collect_garbage_routes(self):
         self.log.debug2("Collecting garbage routes...")
-        action = lambda x: setattr(x, "marked_for_deletion", True)
-        cond = lambda x: x.garbage
 
-        # XXX FIXME GC's next_call_time is 1 second when there is a group
-        # of routes to be deleted. Fix this so it will be lenient enough to
-        # encompass the whole group if possible.
-        next_call_time = self._act_on_routes_before_time(action, cond,
-                                               self.garbage_timer)
+        # Each run waits gc_window seconds past the earliest deadline, so
+        # a group of routes that timed out together is deleted in one run.
+        self._uninstall_routes(self._gc_timers.expired(util.ticks()))
 
-        # Check for deletion flag and *safely* delete those routes
-        for rt in self._routes[:]:
-            if rt.marked_for_deletion:
-                self._uninstall_route(rt)
+        next_call_time = self._next_timer_call(self._gc_timers)
 
         if not next_call_time:
             self.log.debug2("No more routes on GC.")
             self._gc_started = False
         else:
+            next_call_time += self.gc_window
             self.log.debug2("GC running again in %d second(s)" %
                             next_call_time)
-            reactor.callLater(next_call_time, self._collect_garbage_routes)
+            self.reactor.callLater(next_call_time,
+                                   self._collect_garbage_routes)
 
     def _uninstall_route(self, rt):
-        self.log.debug2("Deleting route: %s" % rt)
-        self._sys.uninstall_route(rt.network.ip.exploded, rt.network.prefixlen)
-        self._routes.remove(rt)
+        self._uninstall_routes([rt])
 
-    def init_logging(self, log_config):
-        # debug1 is less verbose, debug5 is more verbose.
-        for (level, name) in [ (10, "DEBUG1"),
-                               (9,  "DEBUG2"),
-                               (8,  "DEBUG3"),
-                               (7,  "DEBUG4"),
-                               (6,  "DEBUG5"),
-                             ]:
-            util.create_new_log_level(level, name)
+    def _uninstall_routes(self, rts):
+        """Delete routes from the RIB and withdraw them from the system
+        routing table in one operation."""
+        if not rts:
+            return
+        for rt in rts:
+            self.log.debug2("Deleting route: %s" % rt)
+            self._routes.remove(rt)
+        self._sys.uninstall_routes([ rt for rt in rts if
+                                     not rt.uninstalled ])
 
+    def init_logging(self, log_config):
+        create_log_levels()
         logging.config.fileConfig(log_config, disable_existing_loggers=True)
         self.log = logging.getLogger("RIP")
 
@@ -267,6 +452,7 @@ class RIP(protocol.DatagramProtocol):
         requested_ifaces -- A list of IP addresses to use"""
         if not requested_ifaces:
             raise(ValueError("Need one or more interface IPs to listen on."))
+        self._requested_ifaces = requested_ifaces
 
         for req_iface in requested_ifaces:
             activated_iface = False
@@ -283,7 +469,103 @@ class RIP(protocol.DatagramProtocol):
     def startProtocol(self):
         for iface in self._sys.logical_ifaces:
             if iface.activated:
-                self.transport.joinGroup("224.0.0.9", iface.ip.ip.exploded)
+                self._join_group(iface)
+
+    def _join_group(self, iface):
+        d = self.transport.joinGroup("224.0.0.9", iface.ip.ip.exploded)
+        d.addErrback(lambda failure: self.log.warn("Couldn't join 224.0.0.9 "
+                     "on %s: %s" % (iface.ip, failure.getErrorMessage())))
+
+    def interface_added(self, iface):
+        """Called by the system interface when an address is added. Starts
+        RIP on it if it was requested."""
+        # An address that changed is removed and added again, possibly with
+        # another prefix length, so updates cached for it are stale.
+        self._forget_cached_updates(iface)
+        if iface.ip.ip.exploded not in self._requested_ifaces:
+            return
+        self.log.info("Starting RIP on %s." % iface.ip)
+        iface.activated = True
+        self._join_group(iface)
+        self.send_request([iface])
+
+    def interface_removed(self, iface):
+        """Called by the system interface when an address is removed."""
+        if iface.activated:
+            self.log.info("Stopping RIP on %s." % iface.ip)
+        self._drop_pacer(iface)
+        self._forget_cached_updates(iface)
+        self._withdraw_routes_via(iface)
+
+    def link_changed(self, phy_iface, up):
+        """Called by the system interface when an interface goes up or
+        down. Routes through an interface that went down are withdrawn
+        straight away instead of waiting for them to time out, and nothing
+        is sent out of it until it comes back up."""
+        for iface in self._sys.logical_ifaces:
+            if iface.phy_iface is not phy_iface:
+                continue
+            if not up:
+                self._drop_pacer(iface)
+                self._withdraw_routes_via(iface)
+            elif iface.activated:
+                self.send_request([iface])
+
+    def local_route_added(self, net, mask):
+        """Called by the system interface when a prefix appears in the main
+        routing table while redistributing. It is advertised as directly
+        reachable, replacing any route to it learned through RIP."""
+        rte = RIPRouteEntry(address=net, mask=mask, nexthop="0.0.0.0",
+                            metric=1, tag=0, imported=True)
+        existing = self._routes.get_by_key(rte.key)
+        if existing is not None:
+            if existing.imported:
+                return
+            self._uninstall_route(existing)
+        self.log.debug1("Redistributing local route %s/%s." % (net, mask))
+        self._redistributed.add(rte.key)
+        self.try_add_route(rte, "0.0.0.0", False)
+        self._route_change = True
+        self.handle_route_change()
+
+    def local_route_removed(self, net, mask):
+        """Called by the system interface when a prefix disappears from the
+        main routing table while redistributing. If it was redistributed,
+        it is advertised as unreachable until garbage collected."""
+        key = rib.RIB.key(ipaddr.IPv4Network(net + "/" + mask))
+        if key not in self._redistributed:
+            return
+        self._redistributed.discard(key)
+        rt = self._routes.get_by_key(key)
+        if rt is None or not rt.imported:
+            return
+        self.log.debug1("Local route %s/%s was removed, withdrawing it." % \
+                        (net, mask))
+        # Imported routes don't time out, so make it an ordinary route for
+        # garbage collection.
+        rt.imported = False
+        self._start_garbage_collection(rt, uninstall=True)
+        self.handle_route_change()
+
+    def _withdraw_routes_via(self, iface):
+        """Start garbage collection for learned routes with a nexthop on
+        iface's subnet, unless the subnet is still reachable through
+        another interface."""
+        for other in self._sys.logical_ifaces:
+            if other is not iface and other.phy_iface.is_up() and \
+               other.ip.network == iface.ip.network and \
+               other.ip.prefixlen == iface.ip.prefixlen:
+                return
+
+        self._responses.forget(iface.ip)
+        withdrawn = self._timeout_timers.withdraw(iface.ip.network._ip,
+                                                  iface.ip.netmask._ip)
+        if not withdrawn:
+            return
+        self.log.info("Withdrawing %d routes through %s." % (len(withdrawn),
+                                                             iface.ip))
+        self._start_garbage_collection_routes(withdrawn, uninstall=True)
+        self.handle_route_change()
 
     def generate_update(self, triggered=False, ifaces=None,
                         dst_ip="224.0.0.9", dst_port=None, split_horizon=True):
@@ -291,65 +573,172 @@ class RIP(protocol.DatagramProtocol):
         if not dst_port:
             dst_port = self.port
 
-        self._last_update_time = datetime.datetime.now()
+        self._last_update_time = self.reactor.seconds()
         self.log.debug2("Sending an update. Triggered = %d." % triggered)
-        hdr = RIPHeader(cmd=RIPHeader.TYPE_RESPONSE, ver=2).serialize()
 
         if not ifaces:
             ifaces_to_use = self.get_active_ifaces()
         else:
             ifaces_to_use = ifaces
 
+        if triggered:
+            changed = self._routes.changed_routes()
+
         for iface in ifaces_to_use:
-            msg = hdr
             self.log.debug4("Preparing update for interface %s" %
                            iface.phy_iface.name)
-            route_count = 0
-            for rt in self._routes:
-                self.log.debug5("Trying to add route to update: %s." % rt)
-                if split_horizon and rt.nexthop in iface.ip:
-                    self.log.debug5("Split horizon prevents sending route.")
-                    continue
-                if triggered and not rt.changed:
-                    self.log.debug5("Route not changed. Skipping.")
-                    continue
+            if triggered:
+                msgs = self._build_update(iface, changed, split_horizon)
+            else:
+                msgs = self._get_cached_update(iface, split_horizon)
 
-                # Use 0.0.0.0 as the nexthop unless the nexthop router is
-                # a different router on the same subnet. Since split horizon
-                # is always used, this should only happen when a route is
-                # imported by this RIP process in a manner that is not
-                # currently implemented -- all imported routes are given
-                # a nexthop of 0.0.0.0.
-                saved_nexthop = rt.nexthop.exploded
-                if rt.nexthop in iface.ip and \
-                   rt.nexthop != iface.ip.ip:
-                    nexthop = rt.nexthop.exploded
-                else:
-                    nexthop = "0.0.0.0"
-                rt.set_nexthop(nexthop)
-                msg += rt.serialize()
-                rt.set_nexthop(saved_nexthop)
-                self.log.debug5("Adding route to update.")
-                route_count += 1
-                if route_count == self.MAX_ROUTES_PER_UPDATE:
-                    self.log.debug5("Max routes per update reached."
-                                   " Sending an update...")
-                    self.send_update(msg, iface.ip.ip.exploded,
-                                     dst_ip, dst_port)
-                    msg = hdr
-                    route_count = 0
-
-            if len(msg) > RIPHeader.SIZE:
+            if triggered and self.update_spread:
+                # Goes out ahead of what is left of a paced periodic update.
+                self._get_pacer(iface).send_urgent(msgs)
+                continue
+            for msg in msgs:
                 self.send_update(msg, iface.ip.ip.exploded, dst_ip, dst_port)
 
         if triggered:
-            for rt in self._routes:
-                rt.changed = False
+            self._routes.clear_changed()
+
+    def _get_cached_update(self, iface, split_horizon, max_age=0):
+        """Return the update messages advertising the whole table out of
+        iface. The messages are rebuilt only if the RIB has changed since
+        they were last built, and they are more than max_age seconds old.
+        If NumPy is available, the whole table is packed by bulkrte in one
+        go."""
+        key = (iface.ip.ip.exploded, split_horizon)
+        generation, built, msgs = self._update_cache.get(key,
+                                                         (None, None, None))
+        if built is not None and \
+           (generation == self._routes.generation or
+            self.reactor.seconds() - built < max_age):
+            return msgs
+
+        self.log.debug4("Rebuilding cached update for interface %s" %
+                        iface.phy_iface.name)
+        if bulkrte.numpy:
+            hdr = RIPHeader(cmd=RIPHeader.TYPE_RESPONSE, ver=2).serialize()
+            msgs = self._get_route_columns().serialize_update(hdr,
+                       iface.ip.ip._ip, iface.ip.prefixlen, split_horizon,
+                       self.MAX_ROUTES_PER_UPDATE)
+        else:
+            msgs = self._build_update(iface, self._routes, split_horizon)
+        self._update_cache[key] = (self._routes.generation,
+                                   self.reactor.seconds(), msgs)
+        return msgs
+
+    def _forget_cached_updates(self, iface):
+        """Drop the updates cached for iface's address."""
+        for split_horizon in (True, False):
+            self._update_cache.pop((iface.ip.ip.exploded, split_horizon),
+                                   None)
+
+    def _get_route_columns(self):
+        """Return a bulkrte.RouteColumns copy of the RIB, rebuilding it if
+        the RIB has changed."""
+        generation, columns = self._route_columns
+        if generation != self._routes.generation:
+            columns = bulkrte.RouteColumns(self._routes)
+            self._route_columns = (self._routes.generation, columns)
+        return columns
+
+    def _build_update(self, iface, routes, split_horizon):
+        """Return a list of update messages advertising routes out of
+        iface."""
+        hdr = RIPHeader(cmd=RIPHeader.TYPE_RESPONSE, ver=2).serialize()
+        iface_net = iface.ip.network._ip
+        iface_mask = iface.ip.netmask._ip
+        iface_ip = iface.ip.ip._ip
+
+        rtes = []
+        for rt in routes:
+            nexthop = rt.nexthop._ip
+            on_link = nexthop & iface_mask == iface_net
+            if split_horizon and on_link:
+                self.log.debug5("Split horizon prevents sending route %s." %
+                                rt)
+                continue
+
+            # Use 0.0.0.0 as the nexthop unless the nexthop router is
+            # a different router on the same subnet. Since split horizon
+            # is always used, this should only happen when a route is
+            # imported by this RIP process in a manner that is not
+            # currently implemented -- all imported routes are given
+            # a nexthop of 0.0.0.0.
+            if on_link and nexthop != iface_ip:
+                rtes.append(rt.serialize())
+            else:
+                rtes.append(rt.serialize_advertised())
+
+        msgs = []
+        for i in range(0, len(rtes), self.MAX_ROUTES_PER_UPDATE):
+            msgs.append(hdr + "".join(rtes[i:i+self.MAX_ROUTES_PER_UPDATE]))
+        return msgs
 
     def generate_periodic_update(self):
-        self.generate_update()
-        reactor.callLater(self.get_update_interval(),
-                          self.generate_periodic_update)
+        # Scheduled first so that an error sending this update doesn't stop
+        # periodic updates altogether.
+        self.reactor.callLater(self.get_update_interval(),
+                               self.generate_periodic_update)
+        if self.update_spread:
+            self._pace_periodic_update()
+        else:
+            self.generate_update()
+
+    def _pace_periodic_update(self):
+        """Queue the periodic update for each active interface, to be sent
+        spread over update_spread of the update interval. Each interface
+        starts at its own random offset, so that the interfaces' updates
+        don't go out at the same moment, and paced updates finish before
+        the next interval starts."""
+        self._last_update_time = self.reactor.seconds()
+        self.log.debug2("Queueing a paced periodic update.")
+        window = self.update_timer * self.update_spread
+        latest_start = max(self.update_timer - self.JITTER_VALUE - window, 0)
+
+        ifaces = list(self.get_active_ifaces())
+        active = set(iface.ip.ip.exploded for iface in ifaces)
+        for key in self._pacers.keys():
+            if key not in active:
+                self._pacers.pop(key).stop()
+
+        # Each message is built from the RIB as it is sent, so messages sent
+        # after a triggered update reflect its changes. The prefixes are
+        # fixed for the cycle, and sorted so that the order is the same on
+        # every interface; routes added meanwhile are in triggered updates.
+        keys = sorted(rt.key for rt in self._routes)
+        for iface in ifaces:
+            build = functools.partial(self._build_periodic_message, iface)
+            self._get_pacer(iface).send_periodic(keys, build, window,
+                                     random.uniform(0, latest_start),
+                                     self.MAX_ROUTES_PER_UPDATE)
+
+    def _build_periodic_message(self, iface, keys):
+        """Return an update message advertising the routes in the RIB with
+        the given keys out of iface, or None if none are left to send."""
+        routes = [ rt for rt in self._routes.get_many(keys) if rt is not None ]
+        msgs = self._build_update(iface, routes, True)
+        return msgs[0] if msgs else None
+
+    def _get_pacer(self, iface):
+        """Return the pacing.UpdatePacer for iface, creating it if
+        needed."""
+        key = iface.ip.ip.exploded
+        pacer = self._pacers.get(key)
+        if pacer is None:
+            pacer = self._pacers[key] = pacing.UpdatePacer(self.reactor,
+                        functools.partial(self.send_update, src_iface_ip=key),
+                        self.UPDATE_BURST)
+        return pacer
+
+    def _drop_pacer(self, iface):
+        """Stop and forget the pacer for iface, dropping any updates it has
+        waiting."""
+        pacer = self._pacers.pop(iface.ip.ip.exploded, None)
+        if pacer is not None:
+            pacer.stop()
 
     def get_update_interval(self):
         """Get the amount of time until the next update. This is equal to
@@ -359,9 +748,9 @@ class RIP(protocol.DatagramProtocol):
                                                      self.JITTER_VALUE)
 
     def get_active_ifaces(self):
-        """Return active logical interfaces."""
+        """Return active logical interfaces whose link is up."""
         for iface in self._sys.logical_ifaces:
-            if iface.activated:
+            if iface.activated and iface.phy_iface.is_up():
                 yield iface
 
     def send_update(self, msg, src_iface_ip, dst_ip="224.0.0.9",
@@ -369,34 +758,47 @@ class RIP(protocol.DatagramProtocol):
         if not dst_port:
             dst_port = self.port
 
-        self.transport.setOutgoingInterface(src_iface_ip)
-        self.transport.write(msg, (dst_ip, dst_port))
+        # Failing to send (e.g. the route to the destination went away
+        # just now) is logged rather than raised, so that it can't break
+        # the timers and callbacks sending happens from.
+        d = self.transport.setOutgoingInterface(src_iface_ip)
+        if d is not None:
+            d.addErrback(self._log_send_error, src_iface_ip, dst_ip)
+        try:
+            self.transport.write(msg, (dst_ip, dst_port))
+        except socket.error as e:
+            self._log_send_error(e, src_iface_ip, dst_ip)
+
+    def _log_send_error(self, error, src_iface_ip, dst_ip):
+        self.log.warn("Failed to send from %s to %s: %s" % (src_iface_ip,
+                      dst_ip, getattr(error, "value", error)))
 
     def datagramReceived(self, data, host_and_port):
         host = host_and_port[0]
         port = host_and_port[1]
         self.log.debug2("Processing a datagram from host %s." % host)
-        link_local = False
-        host_local = False
-        host = ipaddr.IPv4Address(host)
-        for local_iface in self._sys.logical_ifaces:
-            if host in local_iface.ip:
-                link_local = True
-            if local_iface.ip.ip.exploded == host.exploded:
-                host_local = True
-            if host_local or link_local:
-                break
-
-        if not link_local:
+        addr = util.ip_to_int(host)
+        local_iface = self._sys.iface_index.link_iface(addr)
+
+        if not local_iface:
             self.log.warn("Ignoring advertisement from non link-local host.")
             return
 
-        if host_local:
+        if self._sys.iface_index.owner(addr):
             self.log.debug5("Ignoring message from local system.")
             return
 
+        neighbor = (addr, local_iface.ip.ip._ip)
+        if port == self.port and \
+           self._responses.refresh(neighbor, addr, data, util.ticks()):
+            self._timeout_timers.heard(addr, util.ticks())
+            self.log.debug5("Refreshed routes from a repeated response.")
+            return
+
+        host = ipaddr.IPv4Address(addr)
+
         try:
-            msg = RIPPacket(data=data, src_ip=host.exploded)
+            msg = RIPPacket(data=data, src_ip=host.exploded, compact=True)
             self.log.debug5(msg)
         except FormatException:
             self.log.warn("RIP packet with invalid format received.")
@@ -407,20 +809,23 @@ class RIP(protocol.DatagramProtocol):
             return
 
         if msg.hdr.cmd == RIPHeader.TYPE_REQUEST:
-            self.process_request(msg, host, port, local_iface)
+            self.process_request(msg, host, port, local_iface, data)
         elif msg.hdr.cmd == RIPHeader.TYPE_RESPONSE:
             if port != self.port:
                 self.log.debug5("Advertisement source port was not the RIP "
                                "port. Ignoring.")
                 return
             self.process_response(msg, host)
+            self._responses.remember(neighbor, addr, data,
+                                     [ (rte.key, rte.metric) for rte in
+                                       msg.rtes ], util.ticks())
         else:
             self.log.warn("Received a packet with a command field that was "
                           "not REQUEST or RESPONSE from %s:%d. Command = %d" % \
                            (host, port, msg.hdr.cmd))
             return
 
-    def process_request(self, msg, host, port, local_iface):
+    def process_request(self, msg, host, port, local_iface, data):
         # See RFC 2453 section 3.9.1
         if not msg.rtes:
             return
@@ -429,82 +834,127 @@ class RIP(protocol.DatagramProtocol):
              msg.rtes[0].metric == RIPRouteEntry.MAX_METRIC:
             self._send_whole_response(host, port, local_iface)
         else:
-            self._send_partial_response(host, port, msg)
+            self._send_partial_response(host, port, msg, data)
 
     def _send_whole_response(self, host, port, local_iface):
         """Provide the metric and nexthop address for known routes. Split
         horizon processing is performed. This is the "whole-table" case from
-        RFC 2453 section 3.9.1."""
-        self.generate_update(ifaces=[local_iface], dst_ip=host.exploded,
-                             dst_port=port)
-
-    def _send_partial_response(self, host, port, msg):
-        """Provide the metric and nexthop address for every RTE in msg. No
-        split horizon is performed. This is the "specific" case from RFC 2453
-        section 3.9.1."""
-        for rt in msg.rtes:
-            matching_rt = self.get_route(rt.network.ip.exploded,
-                                         rt.network.netmask.exploded)
-            if not matching_rt:
-                rt.metric = RIPRouteEntry.MAX_METRIC
-            else:
-                rt.metric = matching_rt.metric
-
-        msg.hdr.cmd = RIPHeader.TYPE_RESPONSE
-        self.transport.write(msg.serialize(), (host.exploded, port))
+        RFC 2453 section 3.9.1.
+
+        Each host's requests are rate limited, and the response is reused
+        for requests shortly after one another even if the RIB changes, so
+        that a host sending requests in a loop can't make us rebuild and
+        send the whole table as fast as it likes."""
+        if self.request_rate and not self._allow_request(host._ip):
+            self.whole_requests_throttled += 1
+            self.log.debug2("Ignoring whole-table request from %s over the "
+                            "rate limit." % host)
+            return
+        self.whole_requests_served += 1
+        msgs = self._get_cached_update(local_iface, True,
+                                       self.WHOLE_RESPONSE_MAX_AGE)
+        for msg in msgs:
+            self.send_update(msg, local_iface.ip.ip.exploded, host.exploded,
+                             port)
+
+    def _allow_request(self, addr):
+        """Take a token from the whole-table request bucket of the host
+        with integer address addr, and return whether there was one. See
+        pacing.RequestLimiter."""
+        return self._requesters.allow(addr, self.reactor.seconds())
+
+    def _send_partial_response(self, host, port, msg, data):
+        """Provide the metric for every RTE in msg. No split horizon is
+        performed. This is the "specific" case from RFC 2453 section 3.9.1.
+
+        The response RTEs are the ones in data, the request as received,
+        with only the metric replaced, so msg is left as it is. A request
+        may ask for more routes than fit in an update, so the response is
+        split into messages of at most MAX_ROUTES_PER_UPDATE RTEs."""
+        routes = self._routes.get_many([ rte.key for rte in msg.rtes ])
+        metrics = RIPRouteEntry.PACKED_METRICS
+        unreachable = metrics[RIPRouteEntry.MAX_METRIC]
+        metric_offset = RIPRouteEntry.METRIC_OFFSET
+
+        rtes = []
+        offset = RIPHeader.SIZE
+        for rt in routes:
+            rtes.append(data[offset:offset+metric_offset] +
+                        (unreachable if rt is None else metrics[rt.metric]))
+            offset += RIPRouteEntry.SIZE
+
+        hdr = struct.pack(RIPHeader.FORMAT, RIPHeader.TYPE_RESPONSE,
+                          msg.hdr.ver, 0)
+        for i in range(0, len(rtes), self.MAX_ROUTES_PER_UPDATE):
+            self.transport.write(hdr +
+                                 "".join(rtes[i:i+self.MAX_ROUTES_PER_UPDATE]),
+                                 (host.exploded, port))
 
     def process_response(self, msg, host):
+        self._timeout_timers.heard(host._ip, util.ticks())
         for rte in msg.rtes:
             rte.metric = min(rte.metric + 1, RIPRouteEntry.MAX_METRIC)
             self.try_add_route(rte, host)
         if self._route_change:
             self.handle_route_change()
 
+    def process_rte_batch(self, batch):
+        """Process the valid RTEs of a bulkrte.RTEBatch as though each one
+        had been received in a response from its source address."""
+        for afi, tag, address, prefixlen, nexthop, metric, source in \
+            batch.rows():
+            rte = CompactRTE(afi, tag, address, prefixlen, nexthop,
+                             min(metric + 1, RIPRouteEntry.MAX_METRIC))
+            self.try_add_route(rte, source)
+        if self._route_change:
+            self.handle_route_change()
+
     def handle_route_change(self):
         if self._suppress_triggered_updates:
             return
         self._suppress_triggered_updates = True
 
-        current_time = datetime.datetime.now()
-        trigger_suppression_timeout = \
-                            datetime.timedelta(seconds=random.randrange(1, 5))
+        current_time = self.reactor.seconds()
+        trigger_suppression_timeout = random.randrange(1, 5)
 
         if self._last_update_time + trigger_suppression_timeout < \
            current_time:
             self._send_triggered_update()
         else:
-            reactor.callLater(trigger_suppression_timeout.total_seconds(),
-                              self._send_triggered_update)
+            self.reactor.callLater(trigger_suppression_timeout,
+                                   self._send_triggered_update)
 
     def _send_triggered_update(self):
-        self.generate_update(triggered=True)
-        self._route_change = False
-        self._suppress_triggered_updates = False
+        try:
+            self.generate_update(triggered=True)
+        finally:
+            self._route_change = False
+            self._suppress_triggered_updates = False
 
     def try_add_route(self, rte, host, install=True):
         """Install a route via the given host. If install is False, the
         route is not added to the system routing table and a triggered
         update is not requested."""
         self.log.debug5("try_add_route: Received %s" % rte)
-        bestroute = self.get_route(rte.network.ip.exploded,
-                                   rte.network.netmask.exploded)
+        bestroute = self._routes.get_by_key(rte.key)
 
         rte.set_nexthop(host)
         if not bestroute:
             if rte.metric == RIPRouteEntry.MAX_METRIC:
                 return
 
-            rte.changed = True
-            self._routes.append(rte)
+            rte = rte.to_route_entry()
+            self._routes.add(rte)
+            self._timeout_timers.schedule(rte)
 
             if not install:
                 return
             self._route_change = True
             self._sys.install_route(rte.network.ip.exploded,
                                     rte.network.prefixlen, rte.metric,
-                                    rte.nexthop)
+                                    rte.nexthop, rt=rte)
         else:
-            if rte.nexthop == bestroute.nexthop:
+            if int(rte.nexthop) == bestroute.nexthop._ip:
                 if bestroute.metric != rte.metric:
                     if bestroute.metric != RIPRouteEntry.MAX_METRIC and \
                        rte.metric >= RIPRouteEntry.MAX_METRIC:
@@ -514,36 +964,44 @@ class RIP(protocol.DatagramProtocol):
                 elif not bestroute.garbage:
                     bestroute.init_timeout()
             elif rte.metric < bestroute.metric:
-                self.log.debug3("Found better route to %s via %s in %d" % \
-                               (rte.network.exploded, rte.nexthop, rte.metric))
+                self.log.debug3("Found better route %s" % rte)
                 self.update_route(bestroute, rte)
 
     def update_route(self, oldrt, newrt):
         oldrt.init_timeout()
         oldrt.garbage = False
-        oldrt.changed = True
         oldrt.metric = newrt.metric
-        oldrt.nexthop = newrt.nexthop
-        self._sys.modify_route(oldrt)
+        oldrt.set_nexthop(newrt.nexthop)
+        self._routes.changed(oldrt)
+        if oldrt.uninstalled:
+            oldrt.uninstalled = False
+            self._sys.install_route(oldrt.network.ip.exploded,
+                                    oldrt.network.prefixlen, oldrt.metric,
+                                    oldrt.nexthop, rt=oldrt)
+        else:
+            self._sys.modify_route(oldrt)
         self._route_change = True
+        self._timeout_timers.schedule(oldrt)
 
     def get_route(self, net, mask):
-        for rt in self._routes:
-            if (net == rt.network.ip.exploded) and \
-               (mask == rt.network.netmask.exploded):
-                return rt
-        return None
+        """Return the route to net/mask (both dotted decimal strings), or
+        None if there is no such route."""
+        return self._routes.get(ipaddr.IPv4Network(net + "/" + mask))
 
     def cleanup(self):
         """Clean up any system changes made while running (uninstall
         routes etc.)."""
         # XXX This should probably all be part of _sys.
         self.log.info("Cleaning up.")
+        if self.snapshot_path:
+            self._write_snapshot()
+            self.log.info("Leaving routes installed for a warm restart.")
+            self._sys.cleanup(keep_routes=True)
+            return
+        self._sys.uninstall_routes([ rt for rt in self._routes if
+                                     rt.nexthop.exploded != "0.0.0.0" and
+                                     not rt.uninstalled ])
         self._sys.cleanup()
-        for rt in self._routes:
-            if rt.nexthop.exploded != "0.0.0.0":
-                self._sys.uninstall_route(rt.network.ip.exploded,
-                                          rt.network.prefixlen)
 
 
 class ModifyRouteError(Exception):
@@ -553,10 +1011,16 @@ class ModifyRouteError(Exception):
 
 
 class RIPPacket(object):
-    def __init__(self, data=None, hdr=None, rtes=None, src_ip=None):
+    def __init__(self, data=None, hdr=None, rtes=None, src_ip=None,
+                 compact=False):
         """Create a RIP packet either from the binary data received from the
-        network, or from a RIP header and RTE list."""
-        if data and src_ip:
+        network, or from a RIP header and RTE list.
+
+        If compact is True, RTEs received from the network are decoded into
+        CompactRTE objects instead of RIPRouteEntry objects."""
+        if data and src_ip and compact:
+            self._init_compact_from_net(data, src_ip)
+        elif data and src_ip:
             self._init_from_net(data, src_ip)
         elif hdr and rtes:
             self._init_from_host(hdr, rtes)
@@ -590,6 +1054,49 @@ class RIPPacket(object):
             rte_start += RIPRouteEntry.SIZE
             rte_end += RIPRouteEntry.SIZE
 
+    def _init_compact_from_net(self, data, src_ip):
+        """Init from data received from the network, decoding and validating
+        RTEs in a single pass without copying the data."""
+        datalen = len(data)
+        if datalen < RIPHeader.SIZE or \
+           (datalen - RIPHeader.SIZE) % RIPRouteEntry.SIZE:
+            raise(FormatException)
+        self.hdr = RIPHeader(data[0:RIPHeader.SIZE])
+
+        # Requests use an AFI of 0 to ask for the whole table. Responses
+        # may hold RTEs of other address families, such as authentication
+        # entries (AFI 0xFFFF), which are skipped (RFC 2453 section 3.9.2).
+        # Requests are answered RTE for RTE from the data as received, so
+        # every RTE in them must be decoded.
+        if self.hdr.cmd == RIPHeader.TYPE_REQUEST:
+            valid_afis = (0, CompactRTE.AF_INET)
+            skip_other_afis = False
+        else:
+            valid_afis = (CompactRTE.AF_INET,)
+            skip_other_afis = True
+        src_ip = int(ipaddr.IPv4Address(src_ip))
+        unpack_from = RIPRouteEntry.STRUCT.unpack_from
+        prefixlens = CompactRTE.PREFIXLENS
+        min_metric = RIPRouteEntry.MIN_METRIC
+        max_metric = RIPRouteEntry.MAX_METRIC
+
+        self.rtes = []
+        for offset in xrange(RIPHeader.SIZE, datalen, RIPRouteEntry.SIZE):
+            afi, tag, address, mask, nexthop, metric = unpack_from(data,
+                                                                   offset)
+            if afi not in valid_afis:
+                if skip_other_afis:
+                    continue
+                raise(FormatException)
+            prefixlen = prefixlens.get(mask)
+            if prefixlen is None or \
+               not min_metric <= metric <= max_metric:
+                raise(FormatException)
+            if not nexthop:
+                nexthop = src_ip
+            self.rtes.append(CompactRTE(afi, tag, address & mask, prefixlen,
+                                        nexthop, metric))
+
     def _init_from_host(self, hdr, rtes):
         """Init using a header and rte list provided by the application."""
         if hdr.ver != 2:
@@ -697,8 +1204,13 @@ class RIPSimpleAuthEntry(object):
 class RIPRouteEntry(object):
     FORMAT = ">HHIIII"
     SIZE = struct.calcsize(FORMAT)
+    STRUCT = struct.Struct(FORMAT)
     MIN_METRIC = 0
     MAX_METRIC = 16
+    # Where the metric is in a packed RTE, and each metric packed.
+    METRIC_OFFSET = 16
+    PACKED_METRICS = [ struct.pack(">I", metric) for metric in
+                       range(MAX_METRIC + 1) ]
 
     def __init__(self, rawdata=None, address=None, mask=None, nexthop=None,
                  metric=None, tag=0, src_ip=None, imported=False, afi=2):
@@ -707,7 +1219,9 @@ class RIPRouteEntry(object):
         self.imported = imported
         self.init_timeout()
         self.garbage = False
-        self.marked_for_deletion = False
+        # Set while on GC if the route was already taken out of the system
+        # routing table, so that it isn't uninstalled again.
+        self.uninstalled = False
 
         if rawdata and src_ip:
             self._init_from_net(rawdata, src_ip)
@@ -738,19 +1252,28 @@ class RIPRouteEntry(object):
     def set_nexthop(self, nexthop):
         self.nexthop = ipaddr.IPv4Address(nexthop)
 
+    @property
+    def key(self):
+        """The integer (network, prefix length) pair the route is indexed
+        on in the RIB."""
+        return (self.network.network._ip, self.network.prefixlen)
+
+    def to_route_entry(self):
+        return self
+
     def init_timeout(self):
-        """Sets a timer to the current time. The timer is used as either the
-        "timeout" timer, or the garbage collection timer depending on whether
-        or not self.garbage is set."""
+        """Sets a timer to the current time in ticks (see util.ticks). The
+        timer is used as either the "timeout" timer, or the garbage
+        collection timer depending on whether or not self.garbage is set."""
         if self.imported:
             self.timeout = None
         else:
-            self.timeout = datetime.datetime.now()
+            self.timeout = util.ticks()
 
     def _init_from_net(self, rawdata, src_ip):
         """Init from data received on the network."""
         self.packed = None
-        rte = struct.unpack(self.FORMAT, rawdata)
+        rte = self.STRUCT.unpack(rawdata)
         self.afi = rte[0]
         self.tag = rte[1]
         address = ipaddr.IPv4Address(rte[2])
@@ -787,10 +1310,88 @@ class RIPRouteEntry(object):
         section 4."""
 
         # Always re-pack
-        return struct.pack(self.FORMAT, self.afi, self.tag,
-                                      self.network.network._ip,
-                                      self.network.netmask._ip,
-                                      self.nexthop._ip, self.metric)
+        return self.STRUCT.pack(self.afi, self.tag,
+                                self.network.network._ip,
+                                self.network.netmask._ip,
+                                self.nexthop._ip, self.metric)
+
+    def serialize_advertised(self):
+        """Like serialize, but with a nexthop of 0.0.0.0, which is how
+        routes are normally advertised. The result is kept in self.packed
+        until the route changes (see rib.RIB.changed)."""
+        if self.packed is None:
+            self.packed = self.STRUCT.pack(self.afi, self.tag,
+                                           self.network.network._ip,
+                                           self.network.netmask._ip,
+                                           0, self.metric)
+        return self.packed
+
+
+class CompactRTE(object):
+    """A route entry decoded from the network with all addresses kept as
+    integers. These are much cheaper to create than RIPRouteEntry objects,
+    and are only turned into one (with to_route_entry) when a new route is
+    learned. See RIPPacket(compact=True)."""
+
+    __slots__ = ("afi", "tag", "address", "prefixlen", "nexthop", "metric")
+
+    AF_INET = 2
+    # Prefix lengths keyed on the netmasks for them. Other masks are
+    # invalid.
+    PREFIXLENS = dict(((0xffffffff << (32 - n)) & 0xffffffff, n)
+                      for n in range(33))
+    MASKS = dict((n, mask) for mask, n in PREFIXLENS.iteritems())
+
+    def __init__(self, afi, tag, address, prefixlen, nexthop, metric):
+        self.afi = afi
+        self.tag = tag
+        self.address = address
+        self.prefixlen = prefixlen
+        self.nexthop = nexthop
+        self.metric = metric
+
+    def __repr__(self):
+        return "CompactRTE(address=%s, prefixlen=%d, nexthop=%s, " \
+               "metric=%d, tag=%d)" % (_int_to_ip(self.address),
+               self.prefixlen, _int_to_ip(self.nexthop), self.metric,
+               self.tag)
+
+    @property
+    def key(self):
+        return (self.address, self.prefixlen)
+
+    def set_nexthop(self, nexthop):
+        """nexthop can be an integer or an ipaddr.IPv4Address."""
+        self.nexthop = int(nexthop)
+
+    def to_route_entry(self):
+        """Return an equivalent RIPRouteEntry."""
+        return RIPRouteEntry(address=_int_to_ip(self.address),
+                             mask=self.prefixlen,
+                             nexthop=_int_to_ip(self.nexthop),
+                             metric=self.metric, tag=self.tag, afi=self.afi)
+
+    def serialize(self):
+        return RIPRouteEntry.STRUCT.pack(self.afi, self.tag, self.address,
+                                         self.MASKS[self.prefixlen],
+                                         self.nexthop, self.metric)
+
+
+def create_log_levels():
+    """Create the DEBUG1 through DEBUG5 log levels used in the logging
+    config. Needed before a sysiface system is created outside of RIP."""
+    # debug1 is less verbose, debug5 is more verbose.
+    for (level, name) in [ (10, "DEBUG1"),
+                           (9,  "DEBUG2"),
+                           (8,  "DEBUG3"),
+                           (7,  "DEBUG4"),
+                           (6,  "DEBUG5"),
+                         ]:
+        util.create_new_log_level(level, name)
+
+def _int_to_ip(address):
+    """Convert an integer IPv4 address to a dotted decimal string."""
+    return socket.inet_ntoa(struct.pack(">I", address))
 
 class _RIPException(Exception):
     def __init__(self, message=""):
@@ -826,11 +1427,44 @@ def parse_args(argv):
                   help="Use non-default update/gc/timeout timers. The update "
                   "timer is set to this value and gc/timeout timers are based "
                   "on it")
+    op.add_option("-g", "--gc-window", type="int",
+                  help="Seconds garbage collection may wait in order to "
+                  "delete routes that time out close together in one "
+                  "operation (%d)" % RIP.DEFAULT_GC_WINDOW)
+    op.add_option("-b", "--fib-backend", default="ip",
+                  choices=["ip", "netlink"],
+                  help="How to program routes on Linux: 'ip' runs ip in "
+                  "batch mode, 'netlink' uses an rtnetlink socket (ip)")
+    op.add_option("-R", "--redistribute", default=False,
+                  action="store_true",
+                  help="Import local routes from the kernel and keep "
+                  "following changes to them (implies -I).")
+    op.add_option("-s", "--snapshot", type="str",
+                  help="Save learned routes to this file and restore them "
+                  "at startup. Routes are left installed when exiting, so "
+                  "restarts don't disturb forwarding.")
+    op.add_option("-S", "--snapshot-interval", type="int",
+                  help="Seconds between route snapshots (the update timer)")
+    op.add_option("--update-spread", type="float", metavar="FRACTION",
+                  help="Send each interface's periodic update spread over "
+                  "this fraction of the update interval rather than in one "
+                  "burst. 0 disables pacing (%s)" % RIP.DEFAULT_UPDATE_SPREAD)
+    op.add_option("--request-rate", type="float",
+                  help="Whole-table requests per second answered for each "
+                  "host; others are ignored. 0 answers every request "
+                  "(%s)" % RIP.DEFAULT_REQUEST_RATE)
 
     options, arguments = op.parse_args(argv)
     if not options.interface:
         op.error("At least one interface IP is required (-i).")
 
+    if options.update_spread is not None and \
+       not 0 <= options.update_spread <= 1:
+        op.error("The update spread must be between 0 and 1.")
+
+    if options.request_rate is not None and options.request_rate < 0:
+        op.error("The request rate can't be negative.")
+
     if len(arguments) > 1:
         op.error("Unexpected non-option argument(s): '" + \
                  " ".join(arguments[1:]) + "'") 
@@ -848,7 +1482,9 @@ def main(argv):
         sys.stderr.write("Must run as a privileged user (root/admin/etc.). Exiting.\n")
         return 1
 
-    RIP(options.rip_port, options.route, options.import_routes, options.interface, options.log_config, options.base_timer, options.admin_port)
+    RIP(options.rip_port, options.route, options.import_routes, options.interface, options.log_config, options.base_timer, options.admin_port, options.gc_window, options.fib_backend, options.snapshot, options.snapshot_interval, options.redistribute,
+        update_spread=options.update_spread,
+        request_rate=options.request_rate)
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
@@ -18,17 +18,35 @@
 # along with this program; if not, write to the Free Software 
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import collections
+import errno
 import ipaddr
+import os
+import random
 import subprocess
+import socket
 import re
 import logging
 import logging.config
+import threading
+import time
+
+from twisted.internet import defer
+
+import netlink
+import rib
 
 class _System(object):
     """Abstract class for OS-specific functions. These are all the OS-specific
     methods that need to be overridden by a subclass in order to function on a
     different OS."""
 
+    # Queues and applies route changes, if the subclass uses one.
+    fib_writer = None
+    # Whether watch_local_routes reports routes, including the ones already
+    # in the table.
+    watches_local_routes = False
+
     def init_logging(self, log_config):
         logging.config.fileConfig(log_config, disable_existing_loggers=True)
         self.log = logging.getLogger("System")
@@ -41,16 +59,21 @@ class _System(object):
         kwargs.setdefault("log_config", "logging.conf")
         self.init_logging(kwargs["log_config"])
         self.update_interface_info()
+        self.index_interfaces()
         self.loopback = "127.0.0.1"
 
     def modify_route(self, rt):
         """Update the metric and nexthop address to a prefix."""
-        self.uninstall_route(rt.network.ip.exploded, rt.network.prefixlen)
+        self.uninstall_route(rt.network.ip.exploded, rt.network.prefixlen,
+                             rt=rt)
         self.install_route(rt.network.ip.exploded, rt.network.prefixlen,
-                           rt.metric, rt.nexthop)
+                           rt.metric, rt.nexthop, rt=rt)
 
-    def cleanup(self):
-        """Clean up the system. Called when exiting.
+    def cleanup(self, keep_routes=False):
+        """Clean up the system. Called when exiting. If keep_routes is True,
+        RIP's routes are being left installed for the next run to pick up
+        (see reconcile_fib), so anything needed for them to stay in use
+        should be left in place too.
 
         Override in subclass."""
         assert(False)
@@ -61,19 +84,30 @@ class _System(object):
 
         Sets self.phy_ifaces and self.logical_ifaces to be lists of
         physical interfaces and logical interfaces, respectively. See
-        PhysicalInterface and LogicalInterface classes for examples.
+        PhysicalInterface and LogicalInterface classes for examples. Call
+        index_interfaces afterwards.
 
         Override in subclass."""
         assert(False)
 
-    def uninstall_route(self, net, mask):
-        """Uninstall a route from the system routing table.
+    def uninstall_route(self, net, mask, rt=None):
+        """Uninstall a route from the system routing table. rt is the route
+        entry being uninstalled, if any, for error reporting.
 
         Override in subclass."""
         assert(False)
 
-    def install_route(self, net, preflen, metric, nexthop):
-        """Install a route in the system routing table.
+    def uninstall_routes(self, rts):
+        """Uninstall a list of route entries from the system routing table.
+
+        Override in subclass if the system can do this in one operation."""
+        for rt in rts:
+            self.uninstall_route(rt.network.ip.exploded, rt.network.prefixlen,
+                                 rt=rt)
+
+    def install_route(self, net, preflen, metric, nexthop, rt=None):
+        """Install a route in the system routing table. rt is the route
+        entry being installed, if any, for error reporting.
 
         Override in subclass."""
         assert(False)
@@ -86,14 +120,40 @@ class _System(object):
         Override in subclass."""
         assert(False)
 
+    def watch_interfaces(self, reactor, listener=None):
+        """Keep the interface lists up to date as interfaces and addresses
+        change, telling listener about the changes. See InterfaceMonitor.
+
+        Override in subclass if the system can report changes."""
+        pass
+
+    def watch_local_routes(self, reactor, listener):
+        """Follow changes to the routes returned by get_local_routes,
+        telling listener about them. See LocalRouteMonitor.
+
+        Override in subclass if the system can report changes, and set
+        watches_local_routes."""
+        pass
+
+    def reconcile_fib(self, rts):
+        """Bring the system routing table in line with a list of route
+        entries, which should be all the routes RIP has installed, without
+        assuming anything about the table's current contents. Used at
+        startup to clean up after a previous run.
+
+        Override in subclass if the system keeps RIP's routes apart."""
+        pass
+
+    def index_interfaces(self):
+        """Rebuild self.iface_index from self.logical_ifaces. Must be called
+        whenever logical_ifaces is replaced."""
+        self.iface_index = InterfaceIndex(self.logical_ifaces)
+
     def is_self(self, host):
         """Determines if an IP address belongs to the local machine.
 
         Returns True if so, otherwise returns False."""
-        for iface in self.logical_ifaces:
-            if host == iface.ip.ip.exploded:
-                return True
-        return False
+        return self.iface_index.owner(ipaddr.IPv4Address(host)._ip) is not None
 
 
 class WindowsSystem(_System):
@@ -107,7 +167,7 @@ class WindowsSystem(_System):
     def __init__(self, *args, **kwargs):
         super(_System, self).__thisclass__.__init__(self, *args, **kwargs)
 
-    def cleanup(self):
+    def cleanup(self, keep_routes=False):
         pass
 
     def update_interface_info(self):
@@ -128,7 +188,7 @@ class WindowsSystem(_System):
             self.logical_ifaces.append(LogicalInterface(self.phy_ifaces[0],
                                                         net))
 
-    def uninstall_route(self, net, preflen):
+    def uninstall_route(self, net, preflen, rt=None):
         # Convert the prefix length into a dotted decimal mask
         mask = self.preflen_to_snmask(preflen)
         cmd = self.ROUTE_DEL % { "network": net,
@@ -138,7 +198,7 @@ class WindowsSystem(_System):
         if not "OK!" in output:
             raise ModifyRouteError("uninstall", output)
 
-    def install_route(self, net, preflen, metric, nexthop):
+    def install_route(self, net, preflen, metric, nexthop, rt=None):
         mask = self.preflen_to_snmask(preflen)
         cmd = self.ROUTE_ADD % { "network": net,
                                  "mask":    mask,
@@ -175,21 +235,33 @@ class LinuxSystem(_System):
     """The Linux system interface."""
 
     IP_CMD = "/sbin/ip"
+    watches_local_routes = True
     RT_DEL_ARGS = "route del %(net)s/%(mask)s"
     RT_ADD_ARGS = "route add %(net)s/%(mask)s via %(nh)s metric %(metric)d " \
                   "table %(table)d" 
 
-    def __init__(self, table=52, priority=1000, *args, **kwargs):
+    def __init__(self, table=52, priority=1000, call_later=None,
+                 defer_to_thread=None, *args, **kwargs):
         """Args:
         table -- the routing table to install routes to (if applicable on
             the current platform).
         priority -- the desirability of routes learned by the process
             relative to other routing daemons (if applicable on the current
-            platform"""
+            platform
+        call_later -- A function like reactor.callLater. If given, route
+            changes are queued and applied in batches by an IPBatchWriter
+            instead of running ip once per change.
+        defer_to_thread -- A function like threads.deferToThread. If given
+            along with call_later, the batches are applied on a worker
+            thread."""
         super(_System, self).__thisclass__.__init__(self, *args, **kwargs)
 
         self.table = table
         self.priority = priority
+        self.fib_writer = None
+        if call_later:
+            self.fib_writer = IPBatchWriter(self, call_later,
+                                            defer_to_thread=defer_to_thread)
 
         if self.table > 255 or self.table < 0:
             raise(ValueError)
@@ -202,7 +274,12 @@ class LinuxSystem(_System):
                (self.priority, self.table)).split()
         try:
             output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError:
+        except subprocess.CalledProcessError as e:
+            # Left in place by a previous run for a warm restart.
+            if "File exists" in e.output:
+                self.log.debug1("Rule for table %d already installed." % \
+                                self.table)
+                return
             raise #(ModifyRouteError("rule_install"))
 
     def _uninstall_rule(self):
@@ -217,25 +294,24 @@ class LinuxSystem(_System):
         """Updates self according to the current state of physical and logical
         IP interfaces on the device."""
         ip_output = subprocess.check_output("ip addr show".split())
-        raw_ifaces = re.split("\n\d*: ", ip_output)
-
-        # First interface does not start with a newline, so strip the interface
-        # index.
-        raw_ifaces[0] = raw_ifaces[0].lstrip("1: ")
+        raw_ifaces = re.split("\n(?=\d+: )", ip_output)
 
         self.phy_ifaces = []
         self.logical_ifaces = []
         for iface in raw_ifaces:
-            name = re.match("(.*):", iface).group(1)
+            index, name = re.match("(\d+): (.*?):", iface).groups()
             flags = re.search("<(\S*)> ", iface).group(1).split(",")
             addrs = []
-            phy_iface = PhysicalInterface(name, flags)
+            phy_iface = PhysicalInterface(name, flags, int(index))
             self.phy_ifaces.append(phy_iface)
             for addr in re.findall("\n\s*inet (\S*)", iface):
                 logical_iface = LogicalInterface(phy_iface, addr)
                 self.logical_ifaces.append(logical_iface)
 
-    def uninstall_route(self, net, preflen):
+    def uninstall_route(self, net, preflen, rt=None):
+        if self.fib_writer is not None:
+            self.fib_writer.delete(net, preflen, rt)
+            return
         cmd = [self.IP_CMD] + ("route del %s/%s table %d" % \
                (net, preflen, self.table)).split()
         try:
@@ -243,7 +319,48 @@ class LinuxSystem(_System):
         except subprocess.CalledProcessError:
             raise #ModifyRouteError("route_uninstall", output)
 
-    def install_route(self, net, preflen, metric, nexthop):
+    def uninstall_routes(self, rts):
+        if self.fib_writer is not None:
+            super(LinuxSystem, self).uninstall_routes(rts)
+            return
+        cmds = [ "route del %s/%s table %d" % (rt.network.ip.exploded,
+                 rt.network.prefixlen, self.table) for rt in rts ]
+        for index, error in self._run_batch(cmds):
+            self.log.error("Failed to uninstall %s: %s" % (rts[index],
+                                                           error))
+
+    def _run_batch(self, cmds):
+        """Run a list of ip commands in a single ip process. Every command
+        is attempted even if earlier ones fail. Returns a list of (index,
+        error message) pairs for the commands that failed."""
+        if not cmds:
+            return []
+        cmd = [self.IP_CMD, "-force", "-batch", "-"]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate("\n".join(cmds) + "\n")[0]
+
+        # ip prints the error for a command followed by "Command failed
+        # -:<line number>".
+        failed = []
+        error = []
+        for line in output.splitlines():
+            match = re.match("Command failed -:(\d+)", line)
+            if match:
+                failed.append((int(match.group(1)) - 1, " ".join(error)))
+                error = []
+            else:
+                error.append(line.strip())
+        if proc.returncode and not failed:
+            self.log.error("ip batch exited with %d: %s" % (proc.returncode,
+                                                            output))
+        return failed
+
+    def install_route(self, net, preflen, metric, nexthop, rt=None):
+        if self.fib_writer is not None:
+            self.fib_writer.replace(net, preflen, metric, nexthop, rt)
+            return
         cmd = [self.IP_CMD] + ("route add %s/%s via %s metric %d table %d" % \
                (net, preflen, nexthop, metric, self.table)).split()
         try:
@@ -251,6 +368,14 @@ class LinuxSystem(_System):
         except subprocess.CalledProcessError:
             raise #ModifyRouteError("route_install", output)
 
+    def modify_route(self, rt):
+        if self.fib_writer is not None:
+            self.fib_writer.replace(rt.network.ip.exploded,
+                                    rt.network.prefixlen, rt.metric,
+                                    rt.nexthop, rt)
+            return
+        super(LinuxSystem, self).modify_route(rt)
+
     def get_local_routes(self):
         cmd = [self.IP_CMD] + "route show".split()
         try:
@@ -266,15 +391,998 @@ class LinuxSystem(_System):
             parsed_network = ipaddr.IPv4Network(dst_network)
             yield (parsed_network.ip.exploded, parsed_network.netmask.exploded)
 
-    def cleanup(self):
+    def get_fib_routes(self):
+        """Return the routes in RIP's table as (address, prefix length,
+        metric, nexthop) tuples. Routes without a nexthop are left out."""
+        cmd = [self.IP_CMD] + ("route show table %d" % self.table).split()
+        try:
+            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            # The kernel only creates a table when a route is added to it.
+            if "does not exist" in e.output:
+                return []
+            raise #(ModifyRouteError("route_show", output))
+        routes = []
+        for route in output.splitlines():
+            fields = route.split()
+            if len(fields) < 3 or fields[1] != "via":
+                continue
+            if fields[0] == "default":
+                fields[0] = "0.0.0.0/0"
+            metric = 0
+            if "metric" in fields:
+                metric = int(fields[fields.index("metric") + 1])
+            parsed_network = ipaddr.IPv4Network(fields[0])
+            routes.append((parsed_network.ip.exploded,
+                           parsed_network.prefixlen, metric, fields[2]))
+        return routes
+
+    def watch_interfaces(self, reactor, listener=None):
+        self.iface_monitor = InterfaceMonitor(self, reactor, listener)
+
+    def watch_local_routes(self, reactor, listener):
+        self.route_monitor = LocalRouteMonitor(reactor, listener)
+
+    def reconcile_fib(self, rts):
+        if self.fib_writer is None:
+            return
+        self.fib_writer.load(self.get_fib_routes())
+        changes = self.fib_writer.sync(rts)
+        self.log.info("Found %d routes in table %d, %d changes needed." % \
+                      (len(self.fib_writer.fib()), self.table, changes))
+
+    def cleanup(self, keep_routes=False):
         """Perform any necessary system cleanup."""
-        self._uninstall_rule()
+        if self.fib_writer is not None:
+            self.fib_writer.finish()
+        if not keep_routes:
+            self._uninstall_rule()
+
+
+class NetlinkSystem(LinuxSystem):
+    """A Linux system interface that programs routes and rules over an
+    rtnetlink socket instead of running ip."""
+
+    def __init__(self, reactor=None, call_later=None, *args, **kwargs):
+        """Args:
+        reactor -- If given, route changes are applied in batches on the
+            next reactor tick and their ACKs are collected as they arrive.
+        call_later -- Without a reactor, a function like reactor.callLater
+            used to batch route changes, whose ACKs are then waited for.
+            If neither is given, each change is applied when it is made.
+        Other arguments are as for LinuxSystem. Route changes aren't applied
+        on a worker thread; with a reactor, applying them doesn't block."""
+        kwargs.pop("defer_to_thread", None)
+        self._nlsock = netlink.NetlinkSocket()
+        super(NetlinkSystem, self).__init__(*args, **kwargs)
+        self.fib_writer = NetlinkWriter(self, reactor, call_later)
+
+    def _rule_request(self, msg_type, flags):
+        msg = netlink.rule_message(msg_type, 0, 0, self.priority, self.table)
+        self._nlsock.request(msg_type, flags,
+                             msg[netlink.NLMSGHDR.size:])
+
+    def _install_rule(self):
+        try:
+            self._rule_request(netlink.RTM_NEWRULE,
+                               netlink.NLM_F_CREATE | netlink.NLM_F_EXCL)
+        except netlink.NetlinkError as e:
+            # Left in place by a previous run for a warm restart.
+            if e.errno != errno.EEXIST:
+                raise
+            self.log.debug1("Rule for table %d already installed." % \
+                            self.table)
+
+    def _uninstall_rule(self):
+        self._rule_request(netlink.RTM_DELRULE, 0)
+
+    def update_interface_info(self):
+        """Updates self according to the current state of physical and logical
+        IP interfaces on the device, from rtnetlink dumps."""
+        self.phy_ifaces = []
+        self.logical_ifaces = []
+        phy_by_index = {}
+        payload = netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        for reply in self._nlsock.request(netlink.RTM_GETLINK,
+                                          netlink.NLM_F_DUMP, payload):
+            link = netlink.parse_link(reply)
+            phy_iface = PhysicalInterface(link["name"],
+                                          link_flag_names(link["flags"]),
+                                          link["index"])
+            phy_by_index[link["index"]] = phy_iface
+            self.phy_ifaces.append(phy_iface)
+
+        payload = netlink.IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        for reply in self._nlsock.request(netlink.RTM_GETADDR,
+                                          netlink.NLM_F_DUMP, payload):
+            addr = netlink.parse_addr(reply)
+            if addr["address"] is None or addr["index"] not in phy_by_index:
+                continue
+            self.logical_ifaces.append(LogicalInterface(
+                phy_by_index[addr["index"]],
+                "%s/%d" % (addr["address"], addr["prefixlen"])))
+
+    def get_local_routes(self):
+        payload = netlink.RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+        for reply in self._nlsock.request(netlink.RTM_GETROUTE,
+                                          netlink.NLM_F_DUMP, payload):
+            route = netlink.parse_route(reply)
+            if route["family"] != socket.AF_INET or \
+               route["table"] != netlink.RT_TABLE_MAIN:
+                continue
+            parsed_network = ipaddr.IPv4Network("%s/%d" % (route["dst"],
+                                                route["dst_len"]))
+            yield (parsed_network.ip.exploded, parsed_network.netmask.exploded)
+
+    def get_fib_routes(self):
+        payload = netlink.RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0)
+        routes = []
+        for reply in self._nlsock.request(netlink.RTM_GETROUTE,
+                                          netlink.NLM_F_DUMP, payload):
+            route = netlink.parse_route(reply)
+            if route["family"] != socket.AF_INET or \
+               route["table"] != self.table or route["gateway"] is None:
+                continue
+            routes.append((route["dst"], route["dst_len"],
+                           route["priority"] or 0, route["gateway"]))
+        return routes
+
+class SimulatedSystem(_System):
+    """A system interface with no OS underneath it, for running RIP in
+    tests and benchmarks without privileges. The routing table is a dict,
+    interfaces are made up from the arguments, and route operations can be
+    made slow or unreliable."""
+
+    def __init__(self, interfaces=None, local_routes=None, latency=0,
+                 failure_rate=0, seed=None, call_later=None,
+                 defer_to_thread=None, *args, **kwargs):
+        """Args:
+        interfaces -- A list of (name, addresses) pairs, where addresses is
+            a list of IPs in CIDR notation. Defaults to a single interface,
+            sim0, with address 10.0.0.1/24.
+        local_routes -- Routes in CIDR notation for get_local_routes to
+            return.
+        latency -- Seconds each route operation takes. The time is spent
+            sleeping in the thread that applies the operation.
+        failure_rate -- The probability that a route operation fails.
+        seed -- Seed for the random failures, for repeatable runs.
+        call_later, defer_to_thread -- As for LinuxSystem. If call_later is
+            given, route changes are applied in batches by a
+            SimulatedWriter."""
+        if interfaces is None:
+            interfaces = [ ("sim0", ["10.0.0.1/24"]) ]
+        self._interfaces = interfaces
+        self.local_routes = [ ipaddr.IPv4Network(route) for route in
+                              local_routes or [] ]
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        # The routing table. (metric, nexthop) pairs keyed on (net,
+        # preflen), with nexthops as strings. Route operations may be
+        # applied on a worker thread, so it is only changed or iterated
+        # over with _fib_lock held.
+        self.fib = {}
+        self._fib_lock = threading.Lock()
+        self.ops = 0
+        self.failures = 0
+        self._listener = None
+        super(SimulatedSystem, self).__init__(*args, **kwargs)
+        if call_later:
+            self.fib_writer = SimulatedWriter(self, call_later,
+                                              defer_to_thread=defer_to_thread)
+
+    def update_interface_info(self):
+        self.phy_ifaces = []
+        self.logical_ifaces = []
+        for index, (name, addrs) in enumerate(self._interfaces):
+            phy_iface = PhysicalInterface(name, ["BROADCAST", "MULTICAST",
+                                                 "UP", "LOWER_UP"], index + 1)
+            self.phy_ifaces.append(phy_iface)
+            for addr in addrs:
+                self.logical_ifaces.append(LogicalInterface(phy_iface, addr))
+
+    def apply_op(self, op):
+        """Apply an operation to the routing table, taking self.latency
+        seconds. op is a ("replace", net, preflen, metric, nexthop) or
+        ("delete", net, preflen) tuple. Returns None on success, otherwise
+        an error message."""
+        self.ops += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.failures += 1
+            return "Simulated failure"
+        prefix = op[1:3]
+        with self._fib_lock:
+            if op[0] == "delete":
+                if self.fib.pop(prefix, None) is None:
+                    return "No such process"
+            else:
+                self.fib[prefix] = (op[3], str(op[4]))
+        return None
+
+    def _apply_now(self, op, rt):
+        error = self.apply_op(op)
+        if error:
+            self.log.error("Failed to program %s (%s): %s" % \
+                           (rt or "route", " ".join(map(str, op)), error))
+
+    def install_route(self, net, preflen, metric, nexthop, rt=None):
+        if self.fib_writer is not None:
+            self.fib_writer.replace(net, preflen, metric, nexthop, rt)
+            return
+        self._apply_now(("replace", net, preflen, metric, nexthop), rt)
+
+    def uninstall_route(self, net, preflen, rt=None):
+        if self.fib_writer is not None:
+            self.fib_writer.delete(net, preflen, rt)
+            return
+        self._apply_now(("delete", net, preflen), rt)
+
+    def modify_route(self, rt):
+        self.install_route(rt.network.ip.exploded, rt.network.prefixlen,
+                           rt.metric, rt.nexthop, rt)
+
+    def watch_interfaces(self, reactor, listener=None):
+        self._listener = listener
+
+    def set_link_state(self, name, up):
+        """Bring the interface called name up or down, as if its carrier
+        came or went. As the kernel does, routes through an interface that
+        goes down are removed from the table. The listener given to
+        watch_interfaces is told with link_changed."""
+        for phy_iface in self.phy_ifaces:
+            if phy_iface.name == name:
+                break
+        else:
+            raise(ValueError("No interface called %s." % name))
+        if phy_iface.is_up() == up:
+            return
+        if up:
+            phy_iface.set_flags(["BROADCAST", "MULTICAST", "UP",
+                                 "LOWER_UP"])
+        else:
+            phy_iface.set_flags(["BROADCAST", "MULTICAST", "UP"])
+            for iface in self.logical_ifaces:
+                if iface.phy_iface is not phy_iface:
+                    continue
+                with self._fib_lock:
+                    for prefix, (metric, nexthop) in self.fib.items():
+                        if ipaddr.IPv4Address(nexthop) in iface.ip:
+                            del self.fib[prefix]
+                if self.fib_writer is not None:
+                    self.fib_writer.forget_nexthops(iface.ip)
+        if self._listener is not None:
+            self._listener.link_changed(phy_iface, up)
+
+    def get_local_routes(self):
+        for network in self.local_routes:
+            yield (network.ip.exploded, network.netmask.exploded)
+
+    def get_fib_routes(self):
+        with self._fib_lock:
+            return [ (net, preflen, metric, nexthop) for (net, preflen),
+                     (metric, nexthop) in self.fib.items() ]
+
+    def reconcile_fib(self, rts):
+        if self.fib_writer is None:
+            return
+        self.fib_writer.load(self.get_fib_routes())
+        changes = self.fib_writer.sync(rts)
+        self.log.info("Found %d simulated routes, %d changes needed." % \
+                      (len(self.fib), changes))
+
+    def cleanup(self, keep_routes=False):
+        if self.fib_writer is not None:
+            self.fib_writer.finish()
+        self.log.info("%d simulated route operations, %d failed." % \
+                      (self.ops, self.failures))
+
+
+class _FIBWriter(object):
+    """Queues route changes and applies them in batches. The queue is
+    flushed on the reactor tick after the first change is queued, or as
+    soon as max_ops changes are queued.
+
+    Changes are queued per prefix, and a change supersedes any change to
+    the same prefix that hasn't been applied yet. If defer_to_thread is
+    given, batches are applied on a worker thread one at a time, so the
+    reactor keeps running while the kernel is programmed; changes queued
+    meanwhile go in the next batch.
+
+    A shadow copy of the routes programmed into the table is kept, so
+    changes that wouldn't alter the table are dropped, and sync can bring
+    the table in line with a set of routes with the fewest changes. Load it
+    with the table's contents (see LinuxSystem.reconcile_fib) before
+    syncing.
+
+    Changes are made with replace operations. The kernel tells routes to the
+    same prefix apart by metric though, so if a route's metric changes, the
+    old route is deleted first.
+
+    Subclasses build operations with _replace_op and _delete_op and apply
+    them with _apply."""
+
+    def __init__(self, system, call_later, max_ops=1000,
+                 defer_to_thread=None, high_water=20000, low_water=5000):
+        """system -- The LinuxSystem to apply changes to.
+        call_later -- A function like reactor.callLater.
+        max_ops -- Flush once this many changes are queued.
+        defer_to_thread -- A function like threads.deferToThread to apply
+            batches with. If None, batches are applied when flushed.
+        high_water, low_water -- A producer registered with
+            register_producer is paused when more than high_water changes
+            are waiting to be applied, and resumed when fewer than
+            low_water are."""
+        self.system = system
+        self.call_later = call_later
+        self.max_ops = max_ops
+        self.defer_to_thread = defer_to_thread
+        self.high_water = high_water
+        self.low_water = low_water
+        # Changes that haven't been applied, oldest first, keyed on (net,
+        # preflen). Values are (metric, nexthop, rt) tuples, with a metric
+        # of None for a delete.
+        self._queued = collections.OrderedDict()
+        # The shadow table. (metric, nexthop) pairs keyed on (net, preflen),
+        # with nexthops as strings. Updated when changes are sent, and
+        # entries are dropped if a change fails.
+        self._fib = {}
+        self._flush_scheduled = False
+        # Number of changes in the batch being applied, if any.
+        self._in_flight = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        # Deferreds to fire when the next batch has been applied.
+        self._waiters = []
+        self._producer = None
+        self._paused = False
+
+    def __len__(self):
+        return len(self._queued) + self._in_flight
+
+    def register_producer(self, producer):
+        """Register an IPushProducer (e.g. a listening UDP port) to pause
+        while too many changes are waiting to be applied."""
+        self._producer = producer
+        self._paused = False
+        self._check_backpressure()
+
+    def replace(self, net, preflen, metric, nexthop, rt=None):
+        """Queue installing or changing the route to net/preflen."""
+        prefix = (net, preflen)
+        nexthop = str(nexthop)
+        if self._fib.get(prefix) == (metric, nexthop):
+            # Already programmed. Any queued change would undo that.
+            self._queued.pop(prefix, None)
+            return
+        self._queue(prefix, (metric, nexthop, rt))
+
+    def delete(self, net, preflen, rt=None):
+        """Queue uninstalling the route to net/preflen."""
+        prefix = (net, preflen)
+        if prefix not in self._fib:
+            # Not programmed, so at most a queued install needs dropping.
+            self._queued.pop(prefix, None)
+            return
+        self._queue(prefix, (None, None, rt))
+
+    def forget_nexthops(self, network):
+        """Drop shadow entries for routes with a nexthop in network (an
+        ipaddr.IPv4Network). The kernel removes such routes by itself when
+        their interface goes down or loses its address."""
+        for prefix, (metric, nexthop) in self._fib.items():
+            if ipaddr.IPv4Address(nexthop) in network:
+                del self._fib[prefix]
+
+    def load(self, routes):
+        """Replace the shadow table with the routes programmed in the table,
+        given as (net, preflen, metric, nexthop) tuples."""
+        self._fib = dict(((net, preflen), (metric, str(nexthop)))
+                         for net, preflen, metric, nexthop in routes)
+
+    def sync(self, rts):
+        """Queue the changes that make the table hold exactly the given
+        route entries. Returns the number of changes queued."""
+        queued = len(self._queued)
+        wanted = set()
+        for rt in rts:
+            prefix = (rt.network.ip.exploded, rt.network.prefixlen)
+            wanted.add(prefix)
+            self.replace(prefix[0], prefix[1], rt.metric, rt.nexthop, rt)
+        for prefix in set(self._fib).union(self._queued) - wanted:
+            self.delete(prefix[0], prefix[1])
+        return len(self._queued) - queued
+
+    def fib(self):
+        """Return the shadow table as a dict of (metric, nexthop) pairs
+        keyed on (net, preflen)."""
+        return dict(self._fib)
+
+    def _queue(self, prefix, change):
+        self._queued.pop(prefix, None)
+        self._queued[prefix] = change
+        if len(self._queued) >= self.max_ops:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.call_later(0, self.flush)
+        self._check_backpressure()
+
+    def _check_backpressure(self):
+        if self._producer is None:
+            return
+        if not self._paused and len(self) > self.high_water:
+            self.system.log.debug1("%d route changes waiting, pausing "
+                                   "input." % len(self))
+            self._paused = True
+            self._producer.pauseProducing()
+        elif self._paused and len(self) < self.low_water:
+            self.system.log.debug1("%d route changes waiting, resuming "
+                                   "input." % len(self))
+            self._paused = False
+            self._producer.resumeProducing()
+
+    def _build_ops(self):
+        """Turn the queued changes into a list of (prefix, operation, route
+        entry) tuples, update the shadow table and empty the queue."""
+        ops = []
+        for prefix, (metric, nexthop, rt) in self._queued.iteritems():
+            net, preflen = prefix
+            old = self._fib.pop(prefix, None)
+            if old and old[0] != metric:
+                ops.append((prefix, self._delete_op(net, preflen, old[0]),
+                            rt))
+            if metric is None:
+                continue
+            self._fib[prefix] = (metric, nexthop)
+            ops.append((prefix,
+                        self._replace_op(net, preflen, metric, nexthop), rt))
+        self._queued.clear()
+        return ops
+
+    def flush(self):
+        """Start applying all queued changes. Returns a Deferred that fires
+        with a list of (operation, route entry, error message) tuples for
+        the changes that are known to have failed, once they have been
+        applied. Without defer_to_thread, it has already fired."""
+        self._flush_scheduled = False
+        d = defer.Deferred()
+        self._waiters.append(d)
+        if not self._in_flight:
+            self._start_batch()
+        return d
+
+    def _start_batch(self):
+        waiters, self._waiters = self._waiters, []
+        ops = self._build_ops()
+        if not ops:
+            for d in waiters:
+                d.callback([])
+            return
+        self.system.log.debug2("Applying %d route changes." % len(ops))
+
+        self._in_flight = len(ops)
+        if self.defer_to_thread:
+            self._idle.clear()
+            d = self.defer_to_thread(self._apply_in_worker, ops)
+        else:
+            d = defer.maybeDeferred(self._apply, ops)
+        d.addErrback(self._batch_error)
+        d.addCallback(self._batch_done, ops, waiters)
+
+    def _apply_in_worker(self, ops):
+        try:
+            return self._apply(ops)
+        finally:
+            self._idle.set()
+
+    def _batch_error(self, failure):
+        self.system.log.error("Failed to apply route changes: %s" % \
+                              failure.getErrorMessage())
+        return []
+
+    def _batch_done(self, errors, ops, waiters):
+        self._in_flight = 0
+        failures = []
+        for index, error in errors:
+            prefix, op, rt = ops[index]
+            self._report_failure(prefix, op, rt, error)
+            failures.append((op, rt, error))
+        for d in waiters:
+            d.callback(failures)
+        if self._queued or self._waiters:
+            self._start_batch()
+        self._check_backpressure()
+
+    def finish(self):
+        """Wait for the batch being applied, if any, then apply the queued
+        changes before returning. For use when shutting down."""
+        self._idle.wait()
+        ops = self._build_ops()
+        if not ops:
+            return
+        for index, error in self._apply(ops):
+            prefix, op, rt = ops[index]
+            self._report_failure(prefix, op, rt, error)
+
+    def _report_failure(self, prefix, op, rt, error):
+        # The table's state for the prefix is unknown now.
+        self._fib.pop(prefix, None)
+        self.system.log.error("Failed to program %s (%s): %s" % \
+                              (rt or "route", op, error))
+
+    def _replace_op(self, net, preflen, metric, nexthop):
+        assert(False)
+
+    def _delete_op(self, net, preflen, metric=None):
+        assert(False)
+
+    def _apply(self, ops):
+        """Apply a list of (prefix, operation, route entry) tuples. Returns
+        a list of (index, error message) pairs for the operations that
+        failed."""
+        assert(False)
+
+
+class IPBatchWriter(_FIBWriter):
+    """Applies route changes with a single 'ip -batch' process per
+    flush."""
+
+    def _replace_op(self, net, preflen, metric, nexthop):
+        return "route replace %s/%s via %s metric %d table %d" % (net,
+               preflen, nexthop, metric, self.system.table)
+
+    def _delete_op(self, net, preflen, metric=None):
+        if metric is None:
+            return "route del %s/%s table %d" % (net, preflen,
+                                                 self.system.table)
+        return "route del %s/%s metric %d table %d" % (net, preflen, metric,
+                                                       self.system.table)
+
+    def _apply(self, ops):
+        return self.system._run_batch([ op for prefix, op, rt in ops ])
+
+
+class NetlinkWriter(_FIBWriter):
+    """Applies route changes by sending rtnetlink messages, packing as many
+    as fit into each send. If a reactor is given, ACKs are collected as
+    they arrive and failures are logged then; otherwise flush waits for
+    all of them. See NetlinkSystem for the arguments."""
+
+    # Most bytes to send at once.
+    MAX_SEND = 65536
+    # Most unacknowledged messages before waiting for ACKs.
+    MAX_PENDING = 1024
+
+    def __init__(self, system, reactor=None, call_later=None, max_ops=1000):
+        if reactor:
+            call_later = reactor.callLater
+        elif not call_later:
+            call_later = lambda delay, func: func()
+        super(NetlinkWriter, self).__init__(system, call_later, max_ops)
+        self.nlsock = netlink.NetlinkSocket()
+        self.reactor = reactor
+        # Operations that haven't been acknowledged, keyed on sequence
+        # number.
+        self._pending = {}
+        if reactor:
+            reactor.addReader(netlink.NetlinkReader(self.nlsock,
+                                                    self._process_acks))
+
+    def _replace_op(self, net, preflen, metric, nexthop):
+        return (netlink.RTM_NEWROUTE,
+                netlink.NLM_F_CREATE | netlink.NLM_F_REPLACE,
+                net, preflen, nexthop, metric)
+
+    def _delete_op(self, net, preflen, metric=None):
+        return (netlink.RTM_DELROUTE, 0, net, preflen, None, metric)
+
+    def _apply(self, ops):
+        chunk = []
+        chunk_size = 0
+        for prefix, op, rt in ops:
+            msg_type, flags, net, preflen, nexthop, metric = op
+            seq = self.nlsock.next_seq()
+            msg = netlink.route_message(msg_type, flags | \
+                      netlink.NLM_F_REQUEST | netlink.NLM_F_ACK, seq, net,
+                      preflen, self.system.table, nexthop, metric)
+            if chunk_size + len(msg) > self.MAX_SEND:
+                self.nlsock.send("".join(chunk))
+                chunk = []
+                chunk_size = 0
+            chunk.append(msg)
+            chunk_size += len(msg)
+            self._pending[seq] = (prefix, op, rt)
+            while len(self._pending) >= self.MAX_PENDING:
+                if chunk:
+                    self.nlsock.send("".join(chunk))
+                    chunk = []
+                    chunk_size = 0
+                self._process_acks(self.nlsock.recv_messages())
+        if chunk:
+            self.nlsock.send("".join(chunk))
+        if not self.reactor:
+            self.wait()
+        # Failures are reported by _process_acks.
+        return []
+
+    def finish(self):
+        super(NetlinkWriter, self).finish()
+        self.wait()
+
+    def wait(self):
+        """Wait until every sent change has been acknowledged."""
+        while self._pending:
+            self._process_acks(self.nlsock.recv_messages())
+
+    def _process_acks(self, messages):
+        for msg_type, flags, seq, payload in messages:
+            if msg_type != netlink.NLMSG_ERROR or seq not in self._pending:
+                continue
+            prefix, op, rt = self._pending.pop(seq)
+            error = netlink.NLMSGERR.unpack_from(payload)[0]
+            if error:
+                self._report_failure(prefix, self._describe(op), rt,
+                                     os.strerror(-error))
+
+    @staticmethod
+    def _describe(op):
+        msg_type, flags, net, preflen, nexthop, metric = op
+        if msg_type == netlink.RTM_DELROUTE:
+            return "delete %s/%s" % (net, preflen)
+        return "replace %s/%s via %s metric %d" % (net, preflen, nexthop,
+                                                   metric)
+
+class SimulatedWriter(_FIBWriter):
+    """Applies route changes to a SimulatedSystem's table."""
+
+    def _replace_op(self, net, preflen, metric, nexthop):
+        return ("replace", net, preflen, metric, nexthop)
+
+    def _delete_op(self, net, preflen, metric=None):
+        return ("delete", net, preflen)
+
+    def _apply(self, ops):
+        errors = []
+        for index, (prefix, op, rt) in enumerate(ops):
+            error = self.system.apply_op(op)
+            if error:
+                errors.append((index, error))
+        return errors
+
+
+class InterfaceIndex(object):
+    """Maps addresses to logical interfaces without scanning the interface
+    list: local addresses are kept in a dict keyed on the integer address,
+    and interface subnets in a prefix trie."""
+
+    def __init__(self, logical_ifaces=()):
+        self._addrs = {}
+        # Lists of interfaces keyed on integer (network, prefixlen). The
+        # trie holds the same lists.
+        self._subnets = {}
+        self._trie = rib.PrefixTrie()
+        for iface in logical_ifaces:
+            self.add(iface)
+
+    def __len__(self):
+        return sum(len(ifaces) for ifaces in self._subnets.itervalues())
+
+    def add(self, iface):
+        """Index a LogicalInterface."""
+        self._addrs.setdefault(iface.ip.ip._ip, iface)
+        key = (iface.ip.network._ip, iface.ip.prefixlen)
+        ifaces = self._subnets.get(key)
+        if ifaces is None:
+            ifaces = self._subnets[key] = []
+            self._trie.insert(key[0], key[1], ifaces)
+        ifaces.append(iface)
+
+    def remove(self, iface):
+        """Stop indexing a LogicalInterface. Raises KeyError if it isn't
+        indexed."""
+        key = (iface.ip.network._ip, iface.ip.prefixlen)
+        ifaces = self._subnets.get(key, [])
+        if iface not in ifaces:
+            raise(KeyError(iface.ip))
+        ifaces.remove(iface)
+        if not ifaces:
+            del self._subnets[key]
+            self._trie.remove(key[0], key[1])
+
+        addr = iface.ip.ip._ip
+        if self._addrs.get(addr) is iface:
+            del self._addrs[addr]
+            # Another interface may have the same address.
+            for ifaces in self._subnets.itervalues():
+                for other in ifaces:
+                    if other.ip.ip._ip == addr:
+                        self._addrs[addr] = other
+                        return
+
+    def owner(self, addr):
+        """Return the interface with the integer address addr, or None."""
+        return self._addrs.get(addr)
+
+    def link_iface(self, addr):
+        """Return the interface on the most specific subnet containing the
+        integer address addr, preferring activated interfaces, or None if
+        addr isn't on any local subnet."""
+        ifaces = self._trie.lookup(addr)
+        if not ifaces:
+            return None
+        for iface in ifaces:
+            if iface.activated:
+                return iface
+        return ifaces[0]
+
+
+class InterfaceMonitor(object):
+    """Keeps a LinuxSystem's interface lists and interface index up to date
+    from rtnetlink link and IPv4 address notifications, read from the
+    reactor. The listener is told about changes through any of these
+    methods it has:
+
+    interface_added(iface) -- A LogicalInterface was added.
+    interface_removed(iface) -- A LogicalInterface was removed.
+    link_changed(phy_iface, up) -- A PhysicalInterface went up or down (see
+        PhysicalInterface.is_up).
+
+    When an interface is taken down or loses an address, the kernel removes
+    the routes through it, so they are dropped from the FIB shadow before
+    the listener hears about it.
+
+    Changes made after the system last scanned its interfaces but before
+    the monitor subscribed to notifications are picked up by dumping the
+    links and addresses once subscribed, and merging them in."""
+
+    def __init__(self, system, reactor, listener=None):
+        self.system = system
+        self.listener = listener
+        self.nlsock = netlink.NetlinkSocket(groups=netlink.RTMGRP_LINK |
+                                            netlink.RTMGRP_IPV4_IFADDR)
+        reactor.addReader(netlink.NetlinkReader(self.nlsock,
+                                                self.process_messages))
+        self._resync()
+
+    def _resync(self):
+        """Dump the links and IPv4 addresses, and bring the system's
+        interface lists in line with them. Dumped entries that are already
+        known are harmless. The dump needs its own socket, or notifications
+        would be mixed in."""
+        dump_sock = netlink.NetlinkSocket()
+        try:
+            payload = netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+            links = [ netlink.parse_link(reply) for reply in
+                      dump_sock.request(netlink.RTM_GETLINK,
+                                        netlink.NLM_F_DUMP, payload) ]
+            payload = netlink.IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+            addrs = [ netlink.parse_addr(reply) for reply in
+                      dump_sock.request(netlink.RTM_GETADDR,
+                                        netlink.NLM_F_DUMP, payload) ]
+        finally:
+            dump_sock.close()
+
+        indexes = set(link["index"] for link in links)
+        for phy_iface in list(self.system.phy_ifaces):
+            if phy_iface.index not in indexes:
+                self._link_event(netlink.RTM_DELLINK,
+                                 { "index": phy_iface.index })
+        for link in links:
+            self._link_event(netlink.RTM_NEWLINK, link)
+
+        addrs = [ addr for addr in addrs if addr["address"] is not None ]
+        present = set((addr["index"], addr["address"], addr["prefixlen"])
+                      for addr in addrs)
+        for iface in list(self.system.logical_ifaces):
+            if (iface.phy_iface.index, iface.ip.ip.exploded,
+                iface.ip.prefixlen) not in present:
+                self.system.log.info("Address %s was removed from %s." % \
+                                     (iface.ip, iface.phy_iface.name))
+                self._remove_iface(iface)
+        for addr in addrs:
+            self._addr_event(netlink.RTM_NEWADDR, addr)
+
+    def process_messages(self, messages):
+        for msg_type, flags, seq, payload in messages:
+            if msg_type in (netlink.RTM_NEWLINK, netlink.RTM_DELLINK):
+                self._link_event(msg_type, netlink.parse_link(payload))
+            elif msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+                addr = netlink.parse_addr(payload)
+                if addr["address"] is not None:
+                    self._addr_event(msg_type, addr)
+
+    def _notify(self, name, *args):
+        func = getattr(self.listener, name, None)
+        if func:
+            func(*args)
+
+    def _find_phy(self, index):
+        for phy_iface in self.system.phy_ifaces:
+            if phy_iface.index == index:
+                return phy_iface
+        return None
+
+    def _logical_ifaces_on(self, phy_iface):
+        return [ iface for iface in self.system.logical_ifaces
+                 if iface.phy_iface is phy_iface ]
+
+    def _forget_routes_via(self, iface):
+        if self.system.fib_writer is not None:
+            self.system.fib_writer.forget_nexthops(iface.ip)
+
+    def _link_event(self, msg_type, link):
+        phy_iface = self._find_phy(link["index"])
+        if msg_type == netlink.RTM_DELLINK:
+            if not phy_iface:
+                return
+            self.system.log.info("Interface %s was removed." % phy_iface.name)
+            for iface in self._logical_ifaces_on(phy_iface):
+                self._remove_iface(iface)
+            self.system.phy_ifaces.remove(phy_iface)
+            if phy_iface.is_up():
+                phy_iface.set_flags([])
+                self._notify("link_changed", phy_iface, False)
+            return
+
+        if not phy_iface:
+            phy_iface = PhysicalInterface(link["name"], [], link["index"])
+            self.system.phy_ifaces.append(phy_iface)
+        was_up = phy_iface.is_up()
+        was_admin_up = phy_iface.flags is None or "UP" in phy_iface.flags
+        phy_iface.name = link["name"]
+        phy_iface.set_flags(link_flag_names(link["flags"]))
+        if was_admin_up and "UP" not in phy_iface.flags:
+            # Losing the carrier leaves routes in place, but taking the
+            # interface down doesn't.
+            for iface in self._logical_ifaces_on(phy_iface):
+                self._forget_routes_via(iface)
+        if was_up == phy_iface.is_up():
+            return
+
+        self.system.log.info("Interface %s went %s." % (phy_iface.name,
+                             "up" if phy_iface.is_up() else "down"))
+        self._notify("link_changed", phy_iface, phy_iface.is_up())
+
+    def _addr_event(self, msg_type, addr):
+        network = ipaddr.IPv4Network("%s/%d" % (addr["address"],
+                                                addr["prefixlen"]))
+        phy_iface = self._find_phy(addr["index"])
+        existing = None
+        if phy_iface:
+            for iface in self._logical_ifaces_on(phy_iface):
+                if iface.ip.ip == network.ip and \
+                   iface.ip.prefixlen == network.prefixlen:
+                    existing = iface
+                    break
+
+        if msg_type == netlink.RTM_DELADDR:
+            if existing:
+                self.system.log.info("Address %s was removed from %s." % \
+                                     (network, phy_iface.name))
+                self._remove_iface(existing)
+            return
+
+        # Address updates (e.g. lifetimes) are sent as RTM_NEWADDR too.
+        if existing:
+            return
+        if not phy_iface:
+            # The link's flags will come with its own notification; until
+            # then they are unknown, so the interface is taken to be up.
+            phy_iface = PhysicalInterface(addr["label"], None, addr["index"])
+            self.system.phy_ifaces.append(phy_iface)
+        iface = LogicalInterface(phy_iface, network.exploded)
+        self.system.log.info("Address %s was added to %s." % \
+                             (network, phy_iface.name))
+        self.system.logical_ifaces.append(iface)
+        self.system.iface_index.add(iface)
+        self._notify("interface_added", iface)
+
+    def _remove_iface(self, iface):
+        self.system.logical_ifaces.remove(iface)
+        self.system.iface_index.remove(iface)
+        self._forget_routes_via(iface)
+        self._notify("interface_removed", iface)
+
+
+class LocalRouteMonitor(object):
+    """Follows the kernel's main routing table through rtnetlink route
+    notifications, read from the reactor. The listener's
+    local_route_added(net, mask) is called when the first route to a
+    prefix appears, and local_route_removed(net, mask) when the last one
+    goes away, with dotted decimal strings as from get_local_routes. Routes
+    already in the table are reported as added when the monitor starts."""
+
+    def __init__(self, reactor, listener):
+        self.listener = listener
+        # Sets of (tos, priority), which with the prefix identify a route
+        # in a table, keyed on (net, preflen).
+        self._prefixes = {}
+        self.nlsock = netlink.NetlinkSocket(groups=netlink.RTMGRP_IPV4_ROUTE)
+        reactor.addReader(netlink.NetlinkReader(self.nlsock,
+                                                self.process_messages))
+
+        # Dump the table only after subscribing, so that no change is
+        # missed. Notifications about routes in the dump are harmless. The
+        # dump needs its own socket, or notifications would be mixed in.
+        dump_sock = netlink.NetlinkSocket()
+        try:
+            payload = netlink.RTMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0,
+                                         0)
+            for reply in dump_sock.request(netlink.RTM_GETROUTE,
+                                           netlink.NLM_F_DUMP, payload):
+                self._route_event(netlink.RTM_NEWROUTE,
+                                  netlink.parse_route(reply))
+        finally:
+            dump_sock.close()
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def process_messages(self, messages):
+        for msg_type, flags, seq, payload in messages:
+            if msg_type in (netlink.RTM_NEWROUTE, netlink.RTM_DELROUTE):
+                self._route_event(msg_type, netlink.parse_route(payload))
+
+    def _route_event(self, msg_type, route):
+        if route["family"] != socket.AF_INET or \
+           route["table"] != netlink.RT_TABLE_MAIN or \
+           route["type"] != netlink.RTN_UNICAST:
+            return
+        prefix = (route["dst"], route["dst_len"])
+        ident = (route["tos"], route["priority"])
+        routes = self._prefixes.get(prefix)
+
+        if msg_type == netlink.RTM_NEWROUTE:
+            if routes is None:
+                self._prefixes[prefix] = set([ident])
+                self.listener.local_route_added(*self._net_mask(prefix))
+            else:
+                routes.add(ident)
+            return
+
+        if not routes or ident not in routes:
+            return
+        routes.remove(ident)
+        if not routes:
+            del self._prefixes[prefix]
+            self.listener.local_route_removed(*self._net_mask(prefix))
+
+    @staticmethod
+    def _net_mask(prefix):
+        network = ipaddr.IPv4Network("%s/%d" % prefix)
+        return (network.ip.exploded, network.netmask.exploded)
+
+
+def link_flag_names(flags):
+    """Return the names ip uses for the IFF_* bits set in flags."""
+    return [ name for name, bit in [ ("LOOPBACK", netlink.IFF_LOOPBACK),
+                                     ("MULTICAST", netlink.IFF_MULTICAST),
+                                     ("UP", netlink.IFF_UP),
+                                     ("LOWER_UP", netlink.IFF_LOWER_UP) ]
+             if flags & bit ]
 
 
 class PhysicalInterface(object):
-    def __init__(self, name, flags): 
+    def __init__(self, name, flags, index=None): 
         self.name = name 
         self._flags = flags 
+        self.index = index
+
+    @property
+    def flags(self):
+        return self._flags
+
+    def set_flags(self, flags):
+        self._flags = flags
+
+    def is_up(self):
+        """True if the interface is administratively up and has a carrier,
+        or if its flags aren't known (e.g. on Windows)."""
+        if self._flags is None:
+            return True
+        return "UP" in self._flags and "LOWER_UP" in self._flags
  
  
 class LogicalInterface(object):
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Compare the RTE decode rate of RIPPacket's RIPRouteEntry and CompactRTE
+decoders, and of bulkrte if NumPy is available, on full (25 RTE) response
+datagrams."""
+
+import sys
+sys.path.append("..")
+
+import optparse
+import timeit
+
+import bulkrte
+import ripserv
+
+def build_datagram():
+    hdr = ripserv.RIPHeader(cmd=ripserv.RIPHeader.TYPE_RESPONSE, ver=2)
+    rtes = []
+    for i in range(ripserv.RIP.MAX_ROUTES_PER_UPDATE):
+        rtes.append(ripserv.RIPRouteEntry(address="10.%d.0.0" % i,
+                                          mask=16, nexthop="0.0.0.0",
+                                          metric=1 + i % 15, tag=0))
+    return ripserv.RIPPacket(hdr=hdr, rtes=rtes).serialize()
+
+def main(argv):
+    options, arguments = parse_args(argv)
+    data = build_datagram()
+    numrtes = ripserv.RIP.MAX_ROUTES_PER_UPDATE
+
+    for name, compact in [ ("RIPRouteEntry", False),
+                           ("CompactRTE", True) ]:
+        decode = lambda: ripserv.RIPPacket(data=data, src_ip="192.168.1.1",
+                                           compact=compact)
+        best = min(timeit.repeat(decode, number=options.count, repeat=3))
+        print("%-14s %10.0f RTEs/second" % (name,
+                                            numrtes * options.count / best))
+
+    if bulkrte.numpy:
+        datagrams = [ (data, "192.168.1.1") ] * options.count
+        decode = lambda: bulkrte.decode_datagrams(datagrams)
+        best = min(timeit.repeat(decode, number=1, repeat=3))
+        print("%-14s %10.0f RTEs/second" % ("RTEBatch",
+                                            numrtes * options.count / best))
+
+def parse_args(argv):
+    op = optparse.OptionParser()
+    op.add_option("-n", "--count", default=2000, type="int",
+                  help="Datagrams to decode per run (2000).")
+    options, arguments = op.parse_args(argv[1:])
+
+    if arguments:
+        op.error("No non-option arguments are expected.")
+
+    return options, arguments
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Program routes through the ip and netlink backends of sysiface and check
+the results against 'ip route show'. Changes the routing table, so run it in
+a throwaway network namespace, e.g.:
+
+    unshare -rn python netlink_backend.py
+
+A veth pair (rip0/rip1, 10.255.0.1/24 on rip0) is created for the routes'
+nexthops."""
+
+import sys
+sys.path.append("..")
+
+import optparse
+import os
+import subprocess
+import time
+
+from twisted.internet import task
+
+import ripserv
+import sysiface
+
+NEXTHOP = "10.255.0.2"
+
+def setup_link():
+    for cmd in [ "link set lo up",
+                 "link add rip0 type veth peer name rip1",
+                 "link set rip0 up",
+                 "link set rip1 up",
+                 "addr add 10.255.0.1/24 dev rip0" ]:
+        subprocess.check_call(["ip"] + cmd.split())
+
+def table_routes(table):
+    output = subprocess.check_output(["ip", "route", "show", "table",
+                                      str(table)])
+    routes = {}
+    for line in output.splitlines():
+        fields = line.split()
+        routes[fields[0]] = (fields[fields.index("via") + 1],
+                             int(fields[fields.index("metric") + 1]))
+    return routes
+
+def build_routes(count):
+    return [ ripserv.RIPRouteEntry(address="10.%d.%d.0" % (i / 256, i % 256),
+                                   mask=24, nexthop=NEXTHOP, metric=2, tag=0)
+             for i in range(count) ]
+
+def check(system, rts, step):
+    expected = dict(("%s/24" % rt.network.ip.exploded,
+                     (rt.nexthop.exploded, rt.metric)) for rt in rts)
+    actual = table_routes(system.table)
+    if actual != expected:
+        print("  %s: MISMATCH (%d routes expected, %d installed)" % \
+              (step, len(expected), len(actual)))
+        return False
+    return True
+
+def exercise(name, system, flush, rts):
+    start = time.time()
+    for rt in rts:
+        system.install_route(rt.network.ip.exploded, rt.network.prefixlen,
+                             rt.metric, rt.nexthop, rt=rt)
+    flush()
+    elapsed = time.time() - start
+    ok = check(system, rts, "install")
+
+    for rt in rts[::2]:
+        rt.metric = 5
+        system.modify_route(rt)
+    flush()
+    ok = check(system, rts, "modify") and ok
+
+    system.uninstall_routes(rts[::3])
+    flush()
+    ok = check(system, [ rt for i, rt in enumerate(rts) if i % 3 ],
+               "uninstall") and ok
+
+    system.uninstall_routes([ rt for i, rt in enumerate(rts) if i % 3 ])
+    system.cleanup()
+    print("%-8s %6d routes installed in %.3fs (%.0f routes/second): %s" % \
+          (name, len(rts), elapsed, len(rts) / elapsed,
+           "OK" if ok else "FAILED"))
+    return ok
+
+def main(argv):
+    options, arguments = parse_args(argv)
+    ripserv.create_log_levels()
+    if not os.path.isdir("logs"):
+        os.mkdir("logs")
+    setup_link()
+
+    clock = task.Clock()
+    system = sysiface.LinuxSystem(log_config=options.log_config,
+                                  call_later=clock.callLater)
+    ok = exercise("ip", system, lambda: clock.advance(0),
+                  build_routes(options.count))
+
+    system = sysiface.NetlinkSystem(log_config=options.log_config,
+                                    call_later=clock.callLater)
+    ok = exercise("netlink", system, lambda: clock.advance(0),
+                  build_routes(options.count)) and ok
+    return 0 if ok else 1
+
+def parse_args(argv):
+    op = optparse.OptionParser()
+    op.add_option("-n", "--count", default=5000, type="int",
+                  help="Routes to install (5000).")
+    op.add_option("-l", "--log-config", default="../logging.conf",
+                  help="The logging configuration file "
+                       "(default ../logging.conf).")
+    options, arguments = op.parse_args(argv[1:])
+
+    if arguments:
+        op.error("No non-option arguments are expected.")
+
+    return options, arguments
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
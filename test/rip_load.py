@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+
+"""Load a RIP daemon with traffic from many emulated neighbors. Built on
+rip_request.py, which sends a single request.
+
+Each neighbor is a source address on the daemon's subnet that advertises
+its own block of prefixes. Packet slots, paced at --pps, are shared
+between refreshing the neighbors' tables, churn (metric changes,
+withdrawals at metric 16 and flaps back) and whole-table and specific
+requests. Response latency and loss are reported for the requests, and at
+the end a sample of the advertised routes is requested back to see how
+many the daemon dropped.
+
+The source addresses must be configured on the local host; --add-addresses
+does that for the duration of the run. E.g., with the daemon on
+10.255.0.1/24 at the other end of rip1:
+
+    python rip_load.py -d 10.255.0.1 -s 10.255.0.10 -a rip1 -n 50 -p 200 \\
+        --pps 5000 --churn 0.1 --whole 0.01 --specific 0.05"""
+
+import sys
+sys.path.append("..")
+
+import optparse
+import random
+import select
+import socket
+import struct
+import subprocess
+import time
+
+import ipaddr
+
+import ripserv
+from rip_request import create_whole_rtes
+
+RTE_SIZE = 20
+# Offset of the metric in a serialized RTE.
+METRIC_OFFSET = 16
+MAX_RTES = ripserv.RIP.MAX_ROUTES_PER_UPDATE
+MAX_METRIC = ripserv.RIPRouteEntry.MAX_METRIC
+
+RESPONSE_HDR = ripserv.RIPHeader(cmd=ripserv.RIPHeader.TYPE_RESPONSE,
+                                 ver=2).serialize()
+REQUEST_HDR = ripserv.RIPHeader(cmd=ripserv.RIPHeader.TYPE_REQUEST,
+                                ver=2).serialize()
+WHOLE_REQUEST = REQUEST_HDR + "".join(rte.serialize() for rte in
+                                      create_whole_rtes())
+HDR_SIZE = len(RESPONSE_HDR)
+# Packed metrics, indexed by metric.
+METRICS = [ struct.pack(">I", metric) for metric in range(MAX_METRIC + 1) ]
+
+
+class Neighbor(object):
+    """An emulated neighbor and the routes it advertises. The table is kept
+    as serialized update packets, and only packets with a changed metric
+    are rebuilt before being sent again."""
+
+    def __init__(self, address, prefixes, metric, port):
+        self.address = address
+        # Updates and specific requests go out from the RIP port, and
+        # whole-table requests from a port of their own, so that responses
+        # can be told apart.
+        self.sock = self._socket(address, port)
+        self.requester = self._socket(address, 0)
+        self.metric = metric
+        # The RTEs without their metric, which is appended when sending.
+        self.rtes = [ ripserv.RIPRouteEntry(address=net.ip.exploded,
+                          mask=net.prefixlen, nexthop="0.0.0.0",
+                          metric=metric, tag=0).serialize()[:METRIC_OFFSET]
+                      for net in prefixes ]
+        self.metrics = [ metric ] * len(self.rtes)
+        self.packets = [ None ] * ((len(self.rtes) + MAX_RTES - 1) / MAX_RTES)
+        self._next_packet = 0
+        # Send time of the outstanding whole-table request, if any.
+        self.whole_sent = None
+
+    @staticmethod
+    def _socket(address, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((address, port))
+        sock.setblocking(False)
+        return sock
+
+    def _build_packet(self, index):
+        start = index * MAX_RTES
+        rtes = self.rtes[start:start+MAX_RTES]
+        metrics = self.metrics[start:start+MAX_RTES]
+        return RESPONSE_HDR + "".join(rte + METRICS[metric] for rte, metric
+                                      in zip(rtes, metrics))
+
+    def next_update(self):
+        """Return the next packet of the table, round robin."""
+        index = self._next_packet
+        self._next_packet = (index + 1) % len(self.packets)
+        if self.packets[index] is None:
+            self.packets[index] = self._build_packet(index)
+        return self.packets[index]
+
+    def churn(self, rng, withdraw_fraction):
+        """Change one route and return the triggered update for it. A
+        withdrawn route comes back; other routes are withdrawn or get a new
+        metric."""
+        index = rng.randrange(len(self.rtes))
+        if self.metrics[index] == MAX_METRIC:
+            metric = self.metric
+        elif rng.random() < withdraw_fraction:
+            metric = MAX_METRIC
+        else:
+            metric = rng.randrange(1, MAX_METRIC)
+        self.metrics[index] = metric
+        self.packets[index / MAX_RTES] = None
+        return RESPONSE_HDR + self.rtes[index] + METRICS[metric]
+
+    def specific_request(self, indices):
+        return REQUEST_HDR + "".join(self.rtes[index] + METRICS[0]
+                                     for index in indices)
+
+    def close(self):
+        self.sock.close()
+        self.requester.close()
+
+
+class RequestStats(object):
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+        self.sent = 0
+        self.latencies = []
+
+    def answered(self, latency):
+        if latency <= self.timeout:
+            self.latencies.append(latency)
+
+    def report(self):
+        if not self.sent:
+            return
+        lost = self.sent - len(self.latencies)
+        line = "%-20s %7d sent, %5.1f%% lost" % (self.name, self.sent,
+                                                 100.0 * lost / self.sent)
+        latencies = sorted(self.latencies)
+        if latencies:
+            line += ", latency ms: " + ", ".join("%s %.2f" % (name,
+                    latencies[min(int(len(latencies) * q),
+                                  len(latencies) - 1)] * 1000)
+                    for name, q in [ ("p50", 0.5), ("p90", 0.9),
+                                     ("p99", 0.99), ("max", 1.0) ])
+        print(line)
+
+
+class LoadGenerator(object):
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.dst = (options.dst, options.port)
+        self.neighbors = []
+        base = int(ipaddr.IPv4Address(options.prefix_base))
+        src = int(ipaddr.IPv4Address(options.src))
+        for i in range(options.neighbors):
+            prefixes = [ ipaddr.IPv4Network("%s/24" % ipaddr.IPv4Address(
+                         base + (i * options.prefixes + j) * 256))
+                         for j in range(options.prefixes) ]
+            self.neighbors.append(Neighbor(str(ipaddr.IPv4Address(src + i)),
+                                           prefixes, options.metric,
+                                           options.port))
+        self.by_fd = {}
+        self.poll = select.poll()
+        for neighbor in self.neighbors:
+            for sock in (neighbor.sock, neighbor.requester):
+                self.by_fd[sock.fileno()] = (neighbor, sock)
+                self.poll.register(sock, select.POLLIN)
+
+        self.whole = RequestStats("whole-table", options.timeout)
+        self.specific = RequestStats("specific", options.timeout)
+        self.counts = dict((kind, 0) for kind in
+                           [ "update", "churn", "whole", "specific" ])
+        # Send times of outstanding specific requests, keyed on (neighbor
+        # address, first RTE).
+        self._specific_sent = {}
+        # Metrics the daemon reported during verification, keyed the same
+        # way as _specific_sent but per RTE.
+        self._verified = {}
+        self.response_datagrams = 0
+
+    def _choose(self):
+        """Return the kind of packet to send in the next slot."""
+        r = self.rng.random()
+        for kind, fraction in [ ("churn", self.options.churn),
+                                ("whole", self.options.whole),
+                                ("specific", self.options.specific) ]:
+            if r < fraction:
+                return kind
+            r -= fraction
+        return "update"
+
+    def _send(self, kind, now):
+        neighbor = self.rng.choice(self.neighbors)
+        if kind == "whole":
+            if neighbor.whole_sent is not None and \
+               now - neighbor.whole_sent < self.options.timeout:
+                # One outstanding whole-table request per neighbor, so
+                # that the responses can be matched up.
+                kind = "update"
+            else:
+                neighbor.whole_sent = now
+                self.whole.sent += 1
+                neighbor.requester.sendto(WHOLE_REQUEST, self.dst)
+        elif kind == "specific":
+            count = min(self.options.specific_size, len(neighbor.rtes))
+            start = self.rng.randrange(len(neighbor.rtes) - count + 1)
+            self._specific_sent[(neighbor.address,
+                                 neighbor.rtes[start][4:12])] = now
+            self.specific.sent += 1
+            neighbor.sock.sendto(neighbor.specific_request(
+                                 range(start, start + count)), self.dst)
+        elif kind == "churn":
+            neighbor.sock.sendto(neighbor.churn(self.rng,
+                                 self.options.withdraw_fraction), self.dst)
+        if kind == "update":
+            neighbor.sock.sendto(neighbor.next_update(), self.dst)
+        self.counts[kind] += 1
+
+    def _receive(self, timeout):
+        for fd, event in self.poll.poll(timeout * 1000):
+            neighbor, sock = self.by_fd[fd]
+            while True:
+                try:
+                    data = sock.recv(65535)
+                except socket.error:
+                    break
+                self._process_response(neighbor, sock, data)
+
+    def _process_response(self, neighbor, sock, data):
+        now = time.time()
+        self.response_datagrams += 1
+        if sock is neighbor.requester:
+            if neighbor.whole_sent is not None:
+                self.whole.answered(now - neighbor.whole_sent)
+                neighbor.whole_sent = None
+            return
+        if len(data) < HDR_SIZE + RTE_SIZE:
+            return
+        sent = self._specific_sent.pop((neighbor.address,
+                                        data[HDR_SIZE+4:HDR_SIZE+12]), None)
+        if sent is not None:
+            self.specific.answered(now - sent)
+        for offset in range(HDR_SIZE, len(data) - RTE_SIZE + 1, RTE_SIZE):
+            self._verified[(neighbor.address,
+                            data[offset+4:offset+12])] = \
+                struct.unpack_from(">I", data, offset + METRIC_OFFSET)[0]
+
+    def run(self):
+        """Send at the target rate for the configured duration."""
+        pps = float(self.options.pps)
+        start = time.time()
+        end = start + self.options.duration
+        sent = 0
+        behind = 0
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+            due = start + sent / pps
+            if now < due:
+                self._receive(due - now)
+                continue
+            if now - due > 1:
+                behind += 1
+            self._send(self._choose(), now)
+            sent += 1
+            if not sent % 64:
+                self._receive(0)
+        elapsed = time.time() - start
+        # Let late responses in.
+        drain_end = time.time() + self.options.timeout
+        while time.time() < drain_end:
+            self._receive(drain_end - time.time())
+        return sent, elapsed, behind
+
+    def verify(self):
+        """Request a sample of the advertised routes back from the daemon.
+        Returns (routes sampled, routes not as advertised)."""
+        self._verified = {}
+        expected = {}
+        sample = self.options.verify
+        for neighbor in self.neighbors:
+            indices = range(len(neighbor.rtes))
+            self.rng.shuffle(indices)
+            indices = sorted(indices[:sample])
+            for i in range(0, len(indices), MAX_RTES):
+                chunk = indices[i:i+MAX_RTES]
+                neighbor.sock.sendto(neighbor.specific_request(chunk),
+                                     self.dst)
+                self._receive(0)
+            for index in indices:
+                expected[(neighbor.address, neighbor.rtes[index][4:12])] = \
+                    min(neighbor.metrics[index] + 1, MAX_METRIC)
+        drain_end = time.time() + self.options.timeout
+        while time.time() < drain_end and \
+              len(self._verified) < len(expected):
+            self._receive(drain_end - time.time())
+        wrong = sum(1 for key, metric in expected.items()
+                    if self._verified.get(key) != metric)
+        return len(expected), wrong
+
+    def close(self):
+        for neighbor in self.neighbors:
+            neighbor.close()
+
+
+def configure_addresses(options, action):
+    indices = range(options.neighbors)
+    if action == "del":
+        # Deleting the primary address takes the secondaries with it.
+        indices.reverse()
+    for i in indices:
+        address = ipaddr.IPv4Address(int(ipaddr.IPv4Address(options.src)) +
+                                     i)
+        subprocess.call([ "ip", "addr", action, "%s/%d" % (address,
+                          options.src_prefixlen), "dev",
+                          options.add_addresses ])
+
+
+def main(argv):
+    options, arguments = parse_args(argv)
+    if options.add_addresses:
+        configure_addresses(options, "add")
+    try:
+        generator = LoadGenerator(options)
+        table_packets = sum(len(neighbor.packets) for neighbor in
+                            generator.neighbors)
+        update_pps = options.pps * (1 - options.churn - options.whole -
+                                    options.specific)
+        print("%d neighbors advertising %d prefixes in %d packets." % \
+              (options.neighbors, options.neighbors * options.prefixes,
+               table_packets))
+        if update_pps > 0:
+            refresh = table_packets / update_pps
+            print("Each table is refreshed every %.2f seconds." % refresh)
+            if refresh > options.route_timeout:
+                print("Warning: that is longer than the route timeout, so "
+                      "routes will time out.")
+
+        sent, elapsed, behind = generator.run()
+        print("Sent %d packets in %.1fs (%.0f pps, target %d): %s" % \
+              (sent, elapsed, sent / elapsed, options.pps,
+               ", ".join("%d %s" % (generator.counts[kind], kind) for kind
+                         in [ "update", "churn", "whole", "specific" ])))
+        if behind:
+            print("Warning: %d packets were sent over a second late; the "
+                  "target rate is too high for this host." % behind)
+        print("%d response datagrams received." % \
+              generator.response_datagrams)
+        generator.whole.report()
+        generator.specific.report()
+
+        if options.verify:
+            time.sleep(options.settle)
+            sampled, wrong = generator.verify()
+            print("%d of %d sampled routes not as advertised (%.1f%%)." % \
+                  (wrong, sampled, 100.0 * wrong / max(sampled, 1)))
+        generator.close()
+    finally:
+        if options.add_addresses:
+            configure_addresses(options, "del")
+    return 0
+
+
+def parse_args(argv):
+    op = optparse.OptionParser()
+    op.add_option("-d", "--dst", type="string",
+                  help="The router to load.")
+    op.add_option("-P", "--port", default=520, type="int",
+                  help="The RIP port (520)")
+    op.add_option("-s", "--src", type="string",
+                  help="Address of the first neighbor. The others follow "
+                  "it. Must be on the router's subnet.")
+    op.add_option("-a", "--add-addresses", type="string", metavar="DEV",
+                  help="Add the neighbor addresses to DEV for the run.")
+    op.add_option("--src-prefixlen", default=24, type="int",
+                  help="Prefix length for --add-addresses (24)")
+    op.add_option("-n", "--neighbors", default=10, type="int",
+                  help="Number of neighbors (10)")
+    op.add_option("-p", "--prefixes", default=100, type="int",
+                  help="Prefixes advertised by each neighbor (100)")
+    op.add_option("-b", "--prefix-base", default="172.16.0.0",
+                  help="First advertised prefix; /24s follow it "
+                  "(172.16.0.0)")
+    op.add_option("-m", "--metric", default=1, type="int",
+                  help="Metric of the advertised routes (1)")
+    op.add_option("-r", "--pps", default=1000, type="int",
+                  help="Packets per second to send (1000)")
+    op.add_option("-t", "--duration", default=10, type="float",
+                  help="Seconds to send for (10)")
+    op.add_option("--churn", default=0, type="float",
+                  help="Fraction of packets that are triggered updates "
+                  "changing a route (0)")
+    op.add_option("--withdraw-fraction", default=0.3, type="float",
+                  help="Fraction of route changes that withdraw the route "
+                  "(0.3); withdrawn routes flap back on their next change")
+    op.add_option("--whole", default=0, type="float",
+                  help="Fraction of packets that are whole-table requests "
+                  "(0). Split horizon applies to the responses, so the "
+                  "router must have routes from elsewhere to answer them")
+    op.add_option("--specific", default=0, type="float",
+                  help="Fraction of packets that are specific requests (0)")
+    op.add_option("--specific-size", default=1, type="int",
+                  help="Routes per specific request (1)")
+    op.add_option("--timeout", default=2, type="float",
+                  help="Seconds to wait for a response (2)")
+    op.add_option("--route-timeout", default=180, type="float",
+                  help="The router's route timeout, to warn about (180)")
+    op.add_option("-v", "--verify", default=100, type="int",
+                  help="Routes per neighbor to request back after the run "
+                  "(100); 0 to skip")
+    op.add_option("--settle", default=1, type="float",
+                  help="Seconds to wait before verifying (1)")
+    op.add_option("-S", "--seed", default=1, type="int",
+                  help="Random seed (1)")
+    options, arguments = op.parse_args(argv[1:])
+
+    if arguments:
+        op.error("No non-option arguments are expected.")
+    if not options.dst:
+        op.error("The destination router must be specified (-d).")
+    if not options.src:
+        op.error("The first neighbor address must be specified (-s).")
+    if options.churn + options.whole + options.specific > 1:
+        op.error("--churn, --whole and --specific add up to more than 1.")
+    if not 1 <= options.specific_size <= MAX_RTES:
+        op.error("--specific-size must be from 1 to %d." % MAX_RTES)
+    if not 1 <= options.metric < MAX_METRIC:
+        op.error("--metric must be from 1 to %d." % (MAX_METRIC - 1))
+
+    return options, arguments
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -33,25 +33,35 @@ def main(argv):
         print("Sent request. Waiting %d second(s) for response." % wait_time)
 
     # Read response
-    # Assumes the full response comes in a single datagram and that the size
-    # doesn't exceed what we attempt to receive.
+    # Large responses are split into several datagrams. For a specific
+    # request, read until every requested RTE has been answered. The size
+    # of a whole table isn't known, so read until no more datagrams arrive
+    # for a second.
     # Note: a receive size of >1500 bytes does make sense since you may connect
     # to a local rip daemon.
-    buf = ""
+    bufs = []
+    received_rtes = 0
     try:
-        buf = sock.recv(65535)
+        while not options.specific_routes or received_rtes < len(rtes):
+            bufs.append(sock.recv(65535))
+            received_rtes += (len(bufs[-1]) - ripserv.RIPHeader.SIZE) / \
+                             ripserv.RIPRouteEntry.SIZE
+            sock.settimeout(1)
     except socket.timeout:
-        print("Did not receive a response from remote router.")
-        return -1
+        if not bufs:
+            print("Did not receive a response from remote router.")
+            return -1
     except socket.error:
         print("Error sending to the remote router. (Is a RIP "
               "service listening at the destination?)")
         return -1
+    buf = bufs[0][:ripserv.RIPHeader.SIZE] + \
+          "".join(data[ripserv.RIPHeader.SIZE:] for data in bufs)
 
     response = ripserv.RIPPacket(data=buf, src_ip="0.0.0.0")
 
     if not options.quiet:
-        print("Response contained:")
+        print("Response of %d datagram(s) contained:" % len(bufs))
         for rte in response.rtes:
             print(rte)
 
@@ -162,8 +172,6 @@ def parse_args(argv):
     if options.specific_routes:
         if not options.route:
             op.error("At least one route to request is required (-r).")
-#        if len(options.route) > 25:
-#            op.error("Only <25 routes supported currently.")
     if options.whole_table:
         if options.route:
             op.error("No -r arguments are needed if -w is specified.")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""Unit tests for pacing.UpdatePacer, run against twisted's task.Clock."""
+
+import sys
+sys.path.append("..")
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+import pacing
+
+
+class Table(object):
+    """A routing table of metrics keyed on prefix, from which periodic
+    update messages are built as (prefix, metric) lists."""
+
+    def __init__(self, count):
+        self.metrics = dict((prefix, 1) for prefix in range(count))
+        self.built = 0
+
+    def keys(self):
+        return sorted(self.metrics)
+
+    def build(self, keys):
+        self.built += len(keys)
+        msg = [ (prefix, self.metrics[prefix]) for prefix in keys
+                if prefix in self.metrics ]
+        return msg or None
+
+
+class TestUpdatePacer(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.sent = []
+        self.pacer = pacing.UpdatePacer(self.clock, self.send, 2)
+
+    def send(self, msg):
+        self.sent.append((self.clock.seconds(), msg))
+
+    def periodic_entries(self):
+        return [ entry for _, msg in self.sent if msg != "poison"
+                 for entry in msg ]
+
+    def test_periodic_is_spread_over_window(self):
+        table = Table(1000)
+        self.pacer.send_periodic(table.keys(), table.build, 10,
+                                 per_message=10)
+        self.clock.pump([0.1] * 110)
+        self.assertEqual(len(self.sent), 100)
+        self.assertEqual([ prefix for prefix, _ in self.periodic_entries() ],
+                         table.keys())
+        self.assertTrue(self.sent[-1][0] <= 10.5)
+        self.assertFalse(self.pacer.pending())
+
+    def test_urgent_during_periodic(self):
+        table = Table(1000)
+        self.pacer.send_periodic(table.keys(), table.build, 10,
+                                 per_message=10)
+        self.clock.pump([0.1] * 50)
+        before = len(self.sent)
+
+        # Poison a route that hasn't been sent yet, and send the triggered
+        # update for it.
+        table.metrics[900] = 16
+        self.pacer.send_urgent([ "poison" ])
+        self.clock.pump([0.1] * 60)
+
+        msgs = [ msg for _, msg in self.sent ]
+        self.assertTrue(msgs.index("poison") <= before + 1)
+        self.assertTrue((900, 16) in self.periodic_entries())
+        self.assertFalse((900, 1) in self.periodic_entries())
+        self.assertFalse(self.pacer.pending())
+
+    def test_changes_mid_cycle_send_each_prefix_once(self):
+        table = Table(1000)
+        keys = table.keys()
+        self.pacer.send_periodic(keys, table.build, 10, per_message=25)
+        self.clock.pump([0.1] * 30)
+
+        # Routes change, come and go while the update is being sent.
+        for prefix in range(0, 1000, 7):
+            table.metrics[prefix] = 5
+        for prefix in range(500, 520):
+            del table.metrics[prefix]
+        for prefix in range(2000, 2100):
+            table.metrics[prefix] = 1
+        self.clock.pump([0.1] * 80)
+
+        sent = [ prefix for prefix, _ in self.periodic_entries() ]
+        self.assertEqual(len(sent), len(set(sent)))
+        self.assertEqual(set(sent), set(keys) - set(range(500, 520)))
+        # Each message is built from its own keys only.
+        self.assertEqual(table.built, len(keys))
+        self.assertFalse(self.pacer.pending())
+
+    def test_rounding_error_does_not_stall(self):
+        # A refill that leaves the bucket a rounding error short of a token
+        # must still move the clock on.
+        self.clock.advance(1000000)
+        table = Table(1000)
+        self.pacer.send_periodic(table.keys(), table.build, 3.01875)
+        calls = 0
+        while self.pacer.pending():
+            calls += 1
+            self.assertTrue(calls < 10000)
+            self.clock.advance(min(call.getTime() for call in
+                                   self.clock.getDelayedCalls()) -
+                               self.clock.seconds())
+        self.assertEqual(len(self.sent), 1000)
+
+
+class TestRequestLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = pacing.RequestLimiter(1, 3, 4)
+
+    def test_burst_then_rate(self):
+        results = [ self.limiter.allow("a", 0) for i in range(4) ]
+        self.assertEqual(results, [ True, True, True, False ])
+        self.assertTrue(self.limiter.allow("a", 1))
+        self.assertFalse(self.limiter.allow("a", 1))
+
+    def test_stale_entries_make_way(self):
+        # Hosts that have since gone quiet fill the table.
+        for host in range(4):
+            self.limiter.allow(host, 0)
+        self.assertTrue(self.limiter.allow("neighbor", 10))
+        self.assertTrue(self.limiter.allow("neighbor", 10))
+        self.assertEqual(len(self.limiter), 4)
+
+    def test_new_hosts_throttled_while_table_is_busy(self):
+        for host in range(4):
+            self.limiter.allow(host, 0)
+        # Every bucket is still refilling, so a sweep of new source
+        # addresses gets nothing.
+        for host in range(100, 200):
+            self.assertFalse(self.limiter.allow(host, 0.5))
+        self.assertEqual(len(self.limiter), 4)
+        # Tracked hosts keep their own buckets.
+        self.assertTrue(self.limiter.allow(0, 0.5))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Unit tests for decoding RIPPacket datagrams."""
+
+import sys
+sys.path.append("..")
+
+from twisted.trial import unittest
+
+import ripserv
+
+
+class TestCompactDecode(unittest.TestCase):
+    def build(self, cmd, rtes):
+        hdr = ripserv.RIPHeader(cmd=cmd, ver=2).serialize()
+        return hdr + "".join(rte.serialize() for rte in rtes)
+
+    def route(self, metric=1):
+        return ripserv.RIPRouteEntry(address="10.1.0.0", mask=16,
+                                     nexthop="0.0.0.0", metric=metric, tag=0)
+
+    def decode(self, data):
+        return ripserv.RIPPacket(data=data, src_ip="192.168.1.1",
+                                 compact=True)
+
+    def test_auth_entry_is_skipped(self):
+        data = self.build(ripserv.RIPHeader.TYPE_RESPONSE,
+                          [ ripserv.RIPSimpleAuthEntry(password="secret"),
+                            self.route() ])
+        msg = self.decode(data)
+        self.assertEqual(len(msg.rtes), 1)
+        rte = msg.rtes[0]
+        self.assertEqual(rte.key, self.route().key)
+        self.assertEqual(rte.nexthop,
+                         int(ripserv.ipaddr.IPv4Address("192.168.1.1")))
+        self.assertEqual(rte.metric, 1)
+
+    def test_bad_metric_is_rejected(self):
+        data = self.build(ripserv.RIPHeader.TYPE_RESPONSE,
+                          [ self.route(metric=17) ])
+        self.assertRaises(ripserv.FormatException, self.decode, data)
+
+    def test_bad_length_is_rejected(self):
+        data = self.build(ripserv.RIPHeader.TYPE_RESPONSE, [ self.route() ])
+        self.assertRaises(ripserv.FormatException, self.decode, data[:-1])
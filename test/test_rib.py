@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Unit tests for the RIB helpers in rib."""
+
+import sys
+sys.path.append("..")
+
+from twisted.trial import unittest
+
+import rib
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = rib.ResponseCache(rib.RIB(), max_responses=4,
+                                       max_total=10, max_neighbors=3)
+
+    def remember(self, neighbor, payload, now=0):
+        self.cache.remember(neighbor, neighbor, payload, [], now)
+
+    def test_per_neighbor_cap(self):
+        for i in range(10):
+            self.remember(1, "response %d" % i)
+        self.assertEqual(len(self.cache), 4)
+        self.assertTrue(self.cache.refresh(1, 1, "response 9", 0))
+        self.assertFalse(self.cache.refresh(1, 1, "response 0", 0))
+
+    def test_neighbor_cap(self):
+        for neighbor in range(100):
+            self.remember(neighbor, "response")
+        self.assertEqual(self.cache.neighbors(), 3)
+        self.assertEqual(len(self.cache), 3)
+        self.assertTrue(self.cache.refresh(99, 99, "response", 0))
+        self.assertFalse(self.cache.refresh(0, 0, "response", 0))
+
+    def test_total_cap(self):
+        for neighbor in range(3):
+            for i in range(4):
+                self.remember(neighbor, "response %d" % i)
+        self.assertEqual(len(self.cache), 10)
+        # The least recently heard from neighbor gave up its oldest.
+        self.assertFalse(self.cache.refresh(0, 0, "response 0", 0))
+        self.assertFalse(self.cache.refresh(0, 0, "response 1", 0))
+        self.assertTrue(self.cache.refresh(2, 2, "response 0", 0))
+
+    def test_forget_and_expire(self):
+        self.remember(1, "a", now=0)
+        self.remember(2, "b", now=5)
+        self.cache.expire(3)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.neighbors(), 1)
+        self.cache.forget()
+        self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+"""Run a network of RIP speakers in one process and measure how long it
+takes to converge after topology changes. The speakers are ordinary
+ripserv.RIP instances on sysiface.SimulatedSystem backends, connected by
+an in-memory datagram fabric and driven by a virtual clock, so a run
+needs no privileges and takes far less than the simulated time, e.g.:
+
+    python topology_sim.py -T ring -n 20 -r 50 -f 3 -w 3
+
+Each speaker originates its own prefixes. After the initial convergence,
+links are failed and restored and prefixes are withdrawn and announced
+again. For each event the virtual time until every speaker's routes match
+the shortest paths, the packets and bytes exchanged in that time and the
+CPU time spent are reported."""
+
+import sys
+sys.path.append("..")
+
+import logging
+import math
+import optparse
+import os
+import random
+import socket
+import struct
+import time
+
+import ipaddr
+from twisted.internet import defer
+from twisted.internet import task
+
+import rib
+import ripserv
+import sysiface
+import util
+
+RIP_PORT = 520
+MAX_METRIC = ripserv.RIPRouteEntry.MAX_METRIC
+
+
+def _int_to_ip(address):
+    return socket.inet_ntoa(struct.pack(">I", address))
+
+
+class Link(object):
+    """A point-to-point link between two speakers, numbered from
+    10.0.0.0/8 in /30s."""
+
+    def __init__(self, index, a, b):
+        self.index = index
+        self.ends = (a, b)
+        base = 0x0a000000 + index * 4
+        self.addrs = { a: _int_to_ip(base + 1), b: _int_to_ip(base + 2) }
+        self.up = True
+
+    def ifname(self, node):
+        return "link%d" % self.index
+
+    def peer(self, node):
+        a, b = self.ends
+        return b if node == a else a
+
+
+class SimPort(object):
+    """Stands in for the listening multicast port of one speaker."""
+
+    def __init__(self, fabric, node, protocol):
+        self.fabric = fabric
+        self.node = node
+        self.protocol = protocol
+        self.paused = False
+        self._src = None
+
+    def joinGroup(self, addr, interface=""):
+        return defer.succeed(None)
+
+    def leaveGroup(self, addr, interface=""):
+        return defer.succeed(None)
+
+    def setOutgoingInterface(self, addr):
+        self._src = addr
+
+    def write(self, data, addr):
+        self.fabric.send(self.node, self._src, data, addr[0])
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def receive(self, data, addr):
+        if self.paused:
+            self.fabric.dropped += 1
+            return
+        self.protocol.datagramReceived(data, addr)
+
+
+class SimReactor(object):
+    """The reactor of one speaker: time comes from the shared clock and
+    listening goes through the fabric."""
+
+    def __init__(self, clock, fabric, node):
+        self.clock = clock
+        self.fabric = fabric
+        self.node = node
+
+    def seconds(self):
+        return self.clock.seconds()
+
+    def callLater(self, delay, func, *args, **kwargs):
+        return self.clock.callLater(delay, func, *args, **kwargs)
+
+    def callWhenRunning(self, func, *args, **kwargs):
+        return self.clock.callLater(0, func, *args, **kwargs)
+
+    def listenMulticast(self, port, protocol, interface="",
+                        listenMultiple=False):
+        sim_port = SimPort(self.fabric, self.node, protocol)
+        self.fabric.ports[self.node] = sim_port
+        protocol.makeConnection(sim_port)
+        return sim_port
+
+
+class Fabric(object):
+    """Carries datagrams between speakers over the links that are up.
+    Multicasts go to the peer on the link of the source address; unicasts
+    go to the peer that owns the destination address."""
+
+    def __init__(self, clock, delay):
+        self.clock = clock
+        self.delay = delay
+        self.ports = {}
+        # Link and node for each link address.
+        self.addrs = {}
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+        # Datagrams sent but not yet received.
+        self.in_flight = 0
+
+    def add_link(self, link):
+        for node, addr in link.addrs.items():
+            self.addrs[addr] = (link, node)
+
+    def send(self, node, src, data, dst):
+        if dst == "224.0.0.9":
+            link, owner = self.addrs[src]
+            peer = link.peer(node)
+        else:
+            link, peer = self.addrs.get(dst, (None, None))
+            if link is None or peer == node:
+                return
+            src = link.addrs[node]
+        if not link.up:
+            return
+        self.packets += 1
+        self.bytes += len(data)
+        self.in_flight += 1
+        self.clock.callLater(self.delay, self._deliver, peer, data, src)
+
+    def _deliver(self, peer, data, src):
+        self.in_flight -= 1
+        self.ports[peer].receive(data, (src, RIP_PORT))
+
+
+class Network(object):
+    def __init__(self, edges, count, options):
+        self.clock = task.Clock()
+        util.set_tick_source(self.clock)
+        self.fabric = Fabric(self.clock, options.delay)
+        self.options = options
+        self.links = [ Link(i, a, b) for i, (a, b) in enumerate(edges) ]
+        self.node_links = dict((node, []) for node in range(count))
+        for link in self.links:
+            self.fabric.add_link(link)
+            for node in link.ends:
+                self.node_links[node].append(link)
+
+        # Prefixes originated by each node, in 100.0.0.0/8 and up.
+        self.origins = {}
+        for node in range(count):
+            for i in range(options.routes):
+                net = _int_to_ip(0x64000000 + (node * options.routes + i) *
+                                 256)
+                self.origins[net] = node
+
+        self.systems = []
+        self.speakers = []
+        for node in range(count):
+            ifaces = [ (link.ifname(node), [ "%s/30" % link.addrs[node] ])
+                       for link in self.node_links[node] ]
+            system = sysiface.SimulatedSystem(interfaces=ifaces,
+                         call_later=self.clock.callLater,
+                         log_config=options.log_config)
+            speaker = ripserv.RIP(port=RIP_PORT,
+                          requested_ifaces=[ link.addrs[node] for link in
+                                             self.node_links[node] ],
+                          log_config=options.log_config,
+                          base_timer=options.base_timer, admin_port=None,
+                          system=system,
+                          reactor=SimReactor(self.clock, self.fabric, node),
+                          run_reactor=False)
+            self.systems.append(system)
+            self.speakers.append(speaker)
+        if not options.verbose:
+            for name in [ "RIP", "System" ]:
+                logging.getLogger(name).setLevel(logging.WARN)
+
+    def announce(self, net):
+        node = self.origins[net]
+        self.speakers[node].local_route_added(net, "255.255.255.0")
+
+    def withdraw(self, net):
+        node = self.origins[net]
+        self.speakers[node].local_route_removed(net, "255.255.255.0")
+
+    def set_link(self, link, up):
+        link.up = up
+        if self.options.silent_failures:
+            return
+        for node in link.ends:
+            self.systems[node].set_link_state(link.ifname(node), up)
+
+    def expected(self, announced):
+        """Return, for each node, the metrics of the routes it should have
+        keyed on RIB key."""
+        neighbors = dict((node, []) for node in self.node_links)
+        for link in self.links:
+            if link.up:
+                a, b = link.ends
+                neighbors[a].append(b)
+                neighbors[b].append(a)
+
+        # Hops from each origin that has a prefix announced.
+        hops = {}
+        for origin in set(self.origins[net] for net in announced):
+            distance = { origin: 0 }
+            frontier = [ origin ]
+            while frontier:
+                following = []
+                for node in frontier:
+                    for peer in neighbors[node]:
+                        if peer not in distance:
+                            distance[peer] = distance[node] + 1
+                            following.append(peer)
+                frontier = following
+            hops[origin] = distance
+
+        expected = [ {} for node in self.node_links ]
+        for net in announced:
+            key = rib.RIB.key(ipaddr.IPv4Network(net + "/24"))
+            for node, distance in hops[self.origins[net]].items():
+                if distance + 1 < MAX_METRIC:
+                    expected[node][key] = distance + 1
+        return expected
+
+    def actual(self):
+        return [ dict((rt.key, rt.metric) for rt in
+                      speaker._routes if not rt.garbage and
+                      rt.metric < MAX_METRIC)
+                 for speaker in self.speakers ]
+
+    def generation(self):
+        return sum(speaker._routes.generation for speaker in self.speakers)
+
+    def converge(self, announced, name):
+        """Run the clock until the routes match the topology or the time
+        limit passes, and report on it. Returns True if they matched."""
+        expected = self.expected(announced)
+        start = self.clock.seconds()
+        packets, size = self.fabric.packets, self.fabric.bytes
+        cpu = 0
+        generation = None
+        converged = False
+        while self.clock.seconds() - start <= self.options.limit:
+            # Comparing the routes is costly, so only do it once the network
+            # is quiet and something has changed.
+            if not self.fabric.in_flight and \
+               generation != self.generation():
+                generation = self.generation()
+                if self.actual() == expected:
+                    converged = True
+                    break
+            # Only the speakers' work counts towards the CPU time.
+            before = time.clock()
+            self.clock.advance(max(self.clock.calls[0].getTime() -
+                                   self.clock.seconds(), 0))
+            cpu += time.clock() - before
+        print("%-28s %9s %9d %11d %9.1f" % (name,
+              "%.3fs" % (self.clock.seconds() - start) if converged else
+              "never", self.fabric.packets - packets,
+              self.fabric.bytes - size, cpu * 1000))
+        return converged
+
+    def check_fibs(self):
+        """Return the number of speakers whose simulated table doesn't
+        hold exactly their learned routes. Flushes the FIB writers first."""
+        self.clock.advance(0)
+        mismatched = 0
+        for speaker, system in zip(self.speakers, self.systems):
+            learned = set((rt.network.ip.exploded, rt.network.prefixlen)
+                          for rt in speaker._routes
+                          if not rt.garbage and not rt.imported)
+            programmed = set((net, preflen) for net, preflen, metric,
+                             nexthop in system.get_fib_routes())
+            if programmed != learned:
+                mismatched += 1
+        return mismatched
+
+
+def line(count, rng):
+    return [ (i, i + 1) for i in range(count - 1) ]
+
+
+def ring(count, rng):
+    edges = line(count, rng)
+    if count > 2:
+        edges.append((count - 1, 0))
+    return edges
+
+
+def grid(count, rng):
+    width = int(math.ceil(math.sqrt(count)))
+    edges = []
+    for i in range(count):
+        if (i + 1) % width and i + 1 < count:
+            edges.append((i, i + 1))
+        if i + width < count:
+            edges.append((i, i + width))
+    return edges
+
+
+def random_graph(count, rng, degree=3):
+    # A random spanning tree, so the graph is connected, plus random links
+    # up to the average degree.
+    edges = set((rng.randrange(i), i) for i in range(1, count))
+    wanted = min(count * degree / 2, count * (count - 1) / 2)
+    while len(edges) < wanted:
+        a, b = sorted(rng.sample(range(count), 2))
+        edges.add((a, b))
+    return sorted(edges)
+
+TOPOLOGIES = { "line": line,
+               "ring": ring,
+               "grid": grid,
+               "random": random_graph,
+             }
+
+
+def main(argv):
+    options, arguments = parse_args(argv)
+    ripserv.create_log_levels()
+    if not os.path.isdir("logs"):
+        os.mkdir("logs")
+    rng = random.Random(options.seed)
+    # RIP's timer jitter uses the random module.
+    random.seed(options.seed)
+
+    edges = TOPOLOGIES[options.topology](options.nodes, rng)
+    start = time.clock()
+    network = Network(edges, options.nodes, options)
+    print("%s topology: %d speakers, %d links, %d prefixes (set up in "
+          "%.1fs)" % (options.topology, options.nodes, len(edges),
+                      len(network.origins), time.clock() - start))
+    print("%-28s %9s %9s %11s %9s" % ("Event", "Converge", "Packets",
+                                      "Bytes", "CPU (ms)"))
+
+    announced = set(network.origins)
+    for net in sorted(announced):
+        network.announce(net)
+    ok = network.converge(announced, "initial")
+
+    for i in range(options.failures):
+        link = rng.choice(network.links)
+        a, b = link.ends
+        network.set_link(link, False)
+        ok = network.converge(announced, "fail link %d-%d" % (a, b)) and ok
+        network.set_link(link, True)
+        ok = network.converge(announced, "restore link %d-%d" % (a, b)) \
+             and ok
+
+    for i in range(options.withdrawals):
+        net = rng.choice(sorted(announced))
+        announced.discard(net)
+        network.withdraw(net)
+        ok = network.converge(announced, "withdraw %s" % net) and ok
+        announced.add(net)
+        network.announce(net)
+        ok = network.converge(announced, "announce %s" % net) and ok
+
+    mismatched = network.check_fibs()
+    print("%d packets dropped while paused, %d speakers with a mismatched "
+          "FIB" % (network.fabric.dropped, mismatched))
+    return 0 if ok and not mismatched else 1
+
+
+def parse_args(argv):
+    op = optparse.OptionParser()
+    op.add_option("-T", "--topology", default="ring",
+                  choices=sorted(TOPOLOGIES),
+                  help="Topology: %s (ring)" % ", ".join(sorted(TOPOLOGIES)))
+    op.add_option("-n", "--nodes", default=10, type="int",
+                  help="Number of speakers (10)")
+    op.add_option("-r", "--routes", default=10, type="int",
+                  help="Prefixes originated by each speaker (10)")
+    op.add_option("-f", "--failures", default=2, type="int",
+                  help="Links to fail and restore, one at a time (2)")
+    op.add_option("-w", "--withdrawals", default=2, type="int",
+                  help="Prefixes to withdraw and announce again, one at a "
+                  "time (2)")
+    op.add_option("-s", "--silent-failures", default=False,
+                  action="store_true",
+                  help="Don't tell the speakers on a failed link that it "
+                  "went down, so routes through it have to time out")
+    op.add_option("-t", "--base-timer", default=30, type="int",
+                  help="RIP's base timer (30)")
+    op.add_option("-d", "--delay", default=0.001, type="float",
+                  help="Seconds a datagram takes to cross a link (0.001)")
+    op.add_option("-L", "--limit", default=600, type="float",
+                  help="Simulated seconds to wait for convergence (600)")
+    op.add_option("-S", "--seed", default=1, type="int",
+                  help="Random seed (1)")
+    op.add_option("-v", "--verbose", default=False, action="store_true",
+                  help="Log at the levels in the logging configuration "
+                  "instead of warnings only")
+    op.add_option("-l", "--log-config", default="../logging.conf",
+                  help="The logging configuration file "
+                       "(default ../logging.conf).")
+    options, arguments = op.parse_args(argv[1:])
+
+    if arguments:
+        op.error("No non-option arguments are expected.")
+    if options.nodes < 2:
+        op.error("At least two speakers are needed.")
+
+    return options, arguments
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -3,8 +3,56 @@
 import logging
 import os
 import ctypes
+import socket
+import struct
+import sys
+import time
 from twisted.internet import error
 
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [ ("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long) ]
+
+
+def _find_monotonic():
+    """Return a function returning seconds from a clock that isn't
+    affected by changes to the system time, or time.time if there is no
+    such clock."""
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+    if sys.platform.startswith("linux"):
+        for name in ("librt.so.1", "libc.so.6"):
+            try:
+                clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+            except (OSError, AttributeError):
+                continue
+            clock_gettime.argtypes = [ ctypes.c_int,
+                                       ctypes.POINTER(_timespec) ]
+            def monotonic(clock_gettime=clock_gettime):
+                ts = _timespec()
+                if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)):
+                    errno = ctypes.get_errno()
+                    raise(OSError(errno, os.strerror(errno)))
+                return ts.tv_sec + ts.tv_nsec / 1e9
+            return monotonic
+    elif sys.platform.startswith("win"):
+        get_tick_count = ctypes.windll.kernel32.GetTickCount64
+        get_tick_count.restype = ctypes.c_ulonglong
+        return lambda: get_tick_count() / 1000.0
+    return time.time
+
+monotonic = _find_monotonic()
+
+
+class _MonotonicClock(object):
+    def seconds(self):
+        return monotonic()
+
+# Anything providing IReactorTime.seconds(). See set_tick_source.
+_tick_source = _MonotonicClock()
+
 def create_new_log_level(level, name):
     """Add a custom log level. See my comment here:
     http://stackoverflow.com/questions/2183233/how-to-add-a-custom-loglevel-to-pythons-logging-facility
@@ -15,6 +63,27 @@ def create_new_log_level(level, name):
     logging.addLevelName(level, name)
     setattr(logging.Logger, name.lower(), newlog)
 
+def set_tick_source(clock):
+    """Make ticks() follow clock, which must provide IReactorTime.seconds()
+    (e.g. a twisted.internet.task.Clock). Defaults to a monotonic clock."""
+    global _tick_source
+    _tick_source = clock
+
+def ticks():
+    """Return the current time as a whole number of seconds. Route timers
+    are kept in ticks, which come from a monotonic clock, so that setting
+    the system time doesn't expire or freeze them. Only differences between
+    ticks are meaningful."""
+    return int(_tick_source.seconds())
+
+_IP_STRUCT = struct.Struct("!I")
+
+def ip_to_int(ip):
+    """Convert a dotted decimal IPv4 address string to an integer. Cheaper
+    than going through ipaddr on a per-packet path. Raises socket.error if
+    ip isn't a valid address."""
+    return _IP_STRUCT.unpack(socket.inet_aton(ip))[0]
+
 def is_admin():
     """Cross-platform method of checking for root/admin privs. Works on Linux
     and Windows, haven't tried mac. See: